@@ -8,8 +8,12 @@ Undersampling codes:-
 5 : Center of K-Space Mask (Ignores lines based on given percentage, preserving the aspect ratio)\\
 6 : Center of K-Space Square Mask (Ignores lines based on given percentage, end mask will have same height and width)\\
 
+The number of lines to ignore is computed directly from the shape, and all of them can also return the bounds of the kept (centre) rectangle,
+which can be used to crop the k-Space directly
+
 """
 
+import math
 import numpy as np
 
 __author__ = "Soumick Chatterjee"
@@ -21,102 +25,96 @@ __version__ = "0.0.1"
 __email__ = "soumick.chatterjee@ovgu.de"
 __status__ = "Finished"
 
-def createCenterMaskPercent(slice, percent):
-    mask = np.ones(slice.shape)
-    i = 0
-    currentPercent = 1
-
-    while currentPercent > percent:
-        i += 1
-        mask[0:i, :] = 0
-        mask[slice.shape[0]-i:, :] = 0
-        mask[:, 0:i] = 0
-        mask[:, slice.shape[1]-i:] = 0
-
-        currentPercent = np.count_nonzero(mask)/mask.size
+def createCenterMaskPercent(slice, percent, returnBounds=False):
+    #Same number of lines (i) is ignored from each side, i is the smallest which meets the percent (found directly from the shape)
+    dim1 = slice.shape[0]
+    dim2 = slice.shape[1]
+    i = _smallestRemoval(lambda i: max(dim1-2*i, 0)*max(dim2-2*i, 0), dim1*dim2, percent, math.ceil(min(dim1, dim2)/2))
 
-    return mask
+    mask, bounds = _rectangleMask(slice.shape, i, i)
+    if returnBounds:
+        return mask, bounds
+    else:
+        return mask
 
-def createCenterMaskIgnoreLines(slice, lines2ignore, returnPercent=False):
+def createCenterMaskIgnoreLines(slice, lines2ignore, returnPercent=False, returnBounds=False):
     #lines2ignore from each side
-    mask = np.ones(slice.shape)
-    mask[0:lines2ignore, :] = 0
-    mask[slice.shape[0]-lines2ignore:, :] = 0
-    mask[:, 0:lines2ignore] = 0
-    mask[:, slice.shape[1]-lines2ignore:] = 0
+    mask, bounds = _rectangleMask(slice.shape, lines2ignore, lines2ignore)
 
+    output = (mask,)
     if returnPercent:
-        return mask, np.count_nonzero(mask)/mask.size
-    else:
-        return mask
+        output += (np.count_nonzero(mask)/mask.size,)
+    if returnBounds:
+        output += (bounds,)
+    return output if len(output) > 1 else mask
 
-def createCenterRatioMask(slice, percent, returnNumLinesRemoved=False):
+def createCenterRatioMask(slice, percent, returnNumLinesRemoved=False, returnBounds=False):
     dim1 = slice.shape[0]
     dim2 = slice.shape[1]
     ratio = dim2/dim1
-    
-    mask = np.ones(slice.shape)
-    dim1_now = dim1
-    dim2_should = dim2
-    i = 0
-    currentPercent = 1
-
-    while currentPercent > percent:
-        i += 1
-        mask[0:i, :] = 0
-        mask[slice.shape[0]-i:, :] = 0
-
-        dim1_now = dim1 - (i*2)
-        dim2_should = round(dim1_now * ratio)
-        dim2_removal = int((dim2-dim2_should)/2)
-
-        mask[:, 0:dim2_removal] = 0
-        mask[:, slice.shape[1]-dim2_removal:] = 0
 
-        currentPercent = np.count_nonzero(mask)/mask.size
+    #i lines are ignored from each side of dim1, and dim2 is reduced to keep the aspect ratio. i is the smallest which meets the percent (found directly from the shape)
+    dim2Removal = lambda i: int((dim2-round((dim1-(i*2)) * ratio))/2)
+    i = _smallestRemoval(lambda i: max(dim1-2*i, 0)*max(dim2-2*dim2Removal(i), 0), dim1*dim2, percent, math.ceil(dim1/2))
 
+    mask, bounds = _rectangleMask(slice.shape, i, dim2Removal(i))
    
+    output = (mask,)
     if returnNumLinesRemoved:
+        dim1_now = dim1 - (i*2)
+        dim2_should = round(dim1_now * ratio)
         linesRemoved_dim1 = dim1 - dim1_now
         linesRemoved_dim2 = dim2 - dim2_should
-        return mask, (linesRemoved_dim1, linesRemoved_dim2)
-    else:
-        return mask
+        output += ((linesRemoved_dim1, linesRemoved_dim2),)
+    if returnBounds:
+        output += (bounds,)
+    return output if len(output) > 1 else mask
 
-def createCenterSquareMask(slice, percent, returnNumLinesRemoved=False):
+def createCenterSquareMask(slice, percent, returnNumLinesRemoved=False, returnBounds=False):
     dim1 = slice.shape[0]
     dim2 = slice.shape[1]
-    
-    mask = np.ones(slice.shape)
 
     if(dim1 > dim2):
         linesRemoved_dim1 = dim1 - dim2
         linesRemoved_dim2 = 0
-        mask[0:int(linesRemoved_dim1/2), :] = 0
-        mask[slice.shape[0]-int(linesRemoved_dim1/2):, :] = 0
     else:
         linesRemoved_dim1 = 0
         linesRemoved_dim2 = dim2 - dim1
-        mask[:, 0:int(linesRemoved_dim2/2)] = 0
-        mask[:, slice.shape[1]-int(linesRemoved_dim2/2):] = 0  
-
 
-    i = 0
-    currentPercent = np.count_nonzero(mask)/mask.size
+    #After making it square, i more lines are ignored from each side. i is the smallest which meets the percent (found directly from the shape)
+    ignore_dim1 = int(linesRemoved_dim1/2)
+    ignore_dim2 = int(linesRemoved_dim2/2)
+    i = _smallestRemoval(lambda i: max(dim1-2*(i+ignore_dim1), 0)*max(dim2-2*(i+ignore_dim2), 0), dim1*dim2, percent, 
+                         min(math.ceil(dim1/2)-ignore_dim1, math.ceil(dim2/2)-ignore_dim2))
 
-    while currentPercent > percent:
-        i += 1
-        mask[0:i+int(linesRemoved_dim1/2), :] = 0
-        mask[slice.shape[0]-(i+int(linesRemoved_dim1/2)):, :] = 0
-        mask[:, 0:i+int(linesRemoved_dim2/2)] = 0
-        mask[:, slice.shape[1]-(i+int(linesRemoved_dim2/2)):] = 0
-
-        currentPercent = np.count_nonzero(mask)/mask.size
+    mask, bounds = _rectangleMask(slice.shape, i+ignore_dim1, i+ignore_dim2)
 
     linesRemoved_dim1 = linesRemoved_dim1 + (i*2)
     linesRemoved_dim2 = linesRemoved_dim2 + (i*2)
    
+    output = (mask,)
     if returnNumLinesRemoved:
-        return mask, (linesRemoved_dim1, linesRemoved_dim2)
-    else:
-        return mask
\ No newline at end of file
+        output += ((linesRemoved_dim1, linesRemoved_dim2),)
+    if returnBounds:
+        output += (bounds,)
+    return output if len(output) > 1 else mask
+
+def _smallestRemoval(keptCount, size, percent, maxRemoval):
+    #Smallest number of lines to be ignored from each side (between 0 and maxRemoval), for which keptCount/size is not more than the percent
+    #keptCount(i) is the number of points kept after ignoring i lines from each side, it only decreases with i. So, it's found by a binary search over i
+    low, high = 0, maxRemoval
+    while low < high:
+        mid = (low + high) // 2
+        if keptCount(mid)/size <= percent:
+            high = mid
+        else:
+            low = mid + 1
+    return low
+
+def _rectangleMask(shape, ignore_dim1, ignore_dim2):
+    #Mask keeping the centre rectangle, after ignoring the given number of lines from each side
+    #Returns the mask and the bounds of the kept rectangle ((start_dim1, stop_dim1), (start_dim2, stop_dim2))
+    bounds = ((ignore_dim1, max(shape[0]-ignore_dim1, ignore_dim1)), (ignore_dim2, max(shape[1]-ignore_dim2, ignore_dim2)))
+    mask = np.zeros(shape)
+    mask[bounds[0][0]:bounds[0][1], bounds[1][0]:bounds[1][1]] = 1
+    return mask, bounds
\ No newline at end of file
@@ -7,6 +7,7 @@ This module generates High-frequency mask
 
 import math
 import numpy as np
+from CartesianUndersampling.LineSampler import sampleLines, fitDistribution
 
 __author__ = "Mariio Breitkopf, Soumick Chatterjee"
 __copyright__ = "Copyright 2019, Mario Breitkopf, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -18,27 +19,27 @@ __email__ = "soumick.chatterjee@ovgu.de"
 __status__ = "Finished"
 
 
-def createHighFreqMask(slice, percent, compressFactOfDist, ROdir, returnPDF=False):
+def createHighFreqMask(slice, percent, compressFactOfDist, ROdir, returnPDF=False, seed=None):
     mask = np.zeros(slice.shape)
     if ROdir == 2:
         percent = percent/2
         if slice.shape[0] == slice.shape[1]:
-            mask, distfunc, randseed = _mask1DForROdir(mask, percent, compressFactOfDist, 0)
-            mask, _, _ = _mask1DForROdir(mask, percent, compressFactOfDist, 1, distfunc, randseed)
+            mask, distfunc, lines = _mask1DForROdir(mask, percent, compressFactOfDist, 0, seed=seed)
+            mask, _, _ = _mask1DForROdir(mask, percent, compressFactOfDist, 1, distfunc, lines)
         elif slice.shape[0] > slice.shape[1]:
-            mask, distfunc, randseed = _mask1DForROdir(mask, percent, compressFactOfDist, 0)
+            mask, distfunc, lines = _mask1DForROdir(mask, percent, compressFactOfDist, 0, seed=seed)
             dim_difference = slice.shape[0] - slice.shape[1]
             _distfunc = distfunc[dim_difference//2:(slice.shape[1]+dim_difference//2)]
-            _randseed = randseed[dim_difference//2:(slice.shape[1]+dim_difference//2)]
-            mask, _, _ = _mask1DForROdir(mask, percent, compressFactOfDist, 1, _distfunc, _randseed)
+            _lines = lines[dim_difference//2:(slice.shape[1]+dim_difference//2)]
+            mask, _, _ = _mask1DForROdir(mask, percent, compressFactOfDist, 1, _distfunc, _lines)
         else:
-            mask, distfunc, randseed = _mask1DForROdir(mask, percent, compressFactOfDist, 1)
+            mask, distfunc, lines = _mask1DForROdir(mask, percent, compressFactOfDist, 1, seed=seed)
             dim_difference = slice.shape[1] - slice.shape[0]
             _distfunc = distfunc[dim_difference//2:(slice.shape[0]+dim_difference//2)]
-            _randseed = randseed[dim_difference//2:(slice.shape[0]+dim_difference//2)]
-            mask, _, _ = _mask1DForROdir(mask, percent, compressFactOfDist, 0, _distfunc, _randseed)
+            _lines = lines[dim_difference//2:(slice.shape[0]+dim_difference//2)]
+            mask, _, _ = _mask1DForROdir(mask, percent, compressFactOfDist, 0, _distfunc, _lines)
     else:
-        mask, distfunc, _ = _mask1DForROdir(mask, percent, compressFactOfDist, ROdir)
+        mask, distfunc, _ = _mask1DForROdir(mask, percent, compressFactOfDist, ROdir, seed=seed)
 
     if returnPDF:
         if slice.shape[0] > slice.shape[1]:
@@ -48,40 +49,28 @@ def createHighFreqMask(slice, percent, compressFactOfDist, ROdir, returnPDF=Fals
     else:
         return mask
 
-def _mask1DForROdir(mask, percent, compressFactOfDist, ROdir, distfunc=None, randseed=None):
+def _mask1DForROdir(mask, percent, compressFactOfDist, ROdir, distfunc=None, lines=None, seed=None):
     shape = mask.shape[ROdir]
-    if distfunc is None or randseed is None:
-        #Random Numbers Seed
-        randseed = np.random.random(shape)
-
+    centreBand = slice(round(shape/2-shape/round(shape/4)), round(shape/2+shape/round(shape/4)))
+    if distfunc is None or lines is None:
         #Initialize variables
         x = np.array(range(-math.floor(shape/2)+1,math.floor(shape/2)+1,1))
         xm = math.ceil(x.size/2)
         #mu = 0.5 ;
 
-        currentPercent=1
-        while currentPercent > percent:
-            #Distribution function
-            distfunc = compressFactOfDist*(np.power(x,2) / np.power(xm,2)) 
-            #distfunc = np.sqrt(np.power(xm,2)-compressFactOfDist*np.power(xm,2)) / np.sqrt(np.power(xm,2)-compressFactOfDist*np.power(x,2))
+        #Distribution function, with the compression factor for which the expected number of lines meets the percent
+        compressFactOfDist, distfunc = fitDistribution(lambda compressFactOfDist: compressFactOfDist*(np.power(x,2) / np.power(xm,2)), percent, compressFactOfDist, centreBand)
+        #distfunc = np.sqrt(np.power(xm,2)-compressFactOfDist*np.power(xm,2)) / np.sqrt(np.power(xm,2)-compressFactOfDist*np.power(x,2))
 
-            #Selection of k-space lines
-            B = np.zeros(shape)
-            #B[randseed>distfunc] = 0
-            B[randseed<distfunc] = 1
-            B[round(shape/2-shape/round(shape/4)):round(shape/2+shape/round(shape/4))] = 1
-            currentPercent = np.count_nonzero(B)/B.size
-            compressFactOfDist = np.floor(0.95*compressFactOfDist)
-    else:
         #Selection of k-space lines
-        B = np.zeros(shape)
-        #B[randseed>distfunc] = 0
-        B[randseed<distfunc] = 1
-        B[round(shape/2-shape/round(shape/4)):round(shape/2+shape/round(shape/4))] = 1
+        lines = sampleLines(distfunc, percent, centreBand, seed)
+    else:
+        lines = lines.copy()
+        lines[centreBand] = True
 
     if ROdir == 0:
-        mask[B==1,:] = 1
+        mask[lines,:] = 1
     else: #ROdir == 1:
-        mask[:,B==1] = 1
+        mask[:,lines] = 1
 
-    return mask, distfunc, randseed
+    return mask, distfunc, lines
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+This module selects k-Space lines for the 1D masks (Variable Density 1D and High-frequency masks).
+Exactly round(percent*N) lines are selected out of N, in one vectorized pass: 
+the fully sampled centre band is reserved first, and the remaining lines are drawn by weighted sampling without replacement,
+weighted by the distribution function (PDF).
+
+"""
+
+import numpy as np
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+def sampleLines(distfunc, percent, centreBand=None, seed=None):
+    """Selects exactly round(percent*N) lines (or only the centre band, if it's already more than that)
+    Lines of the centreBand (slice) are always selected. The rest are drawn without replacement, with probabilities proportional to distfunc
+    (Efraimidis-Spirakis: the lines with the largest u**(1/weight), u being uniform random numbers, reproducible if seed is supplied)
+    Returns the selected lines (bool array). The realised acceleration factor is reported by the Sampler, from the whole mask"""
+    nLines = len(distfunc)
+    lines = np.zeros(nLines, dtype=bool)
+    if centreBand is not None:
+        lines[centreBand] = True
+
+    weights = np.clip(distfunc, 0, None)
+    candidates = np.flatnonzero(~lines & (weights > 0))
+    nRemaining = min(int(round(percent*nLines)) - np.count_nonzero(lines), len(candidates))
+    if nRemaining > 0:
+        u = np.random.random(len(candidates)) if seed is None else np.random.default_rng(seed).random(len(candidates))
+        keys = np.log(u) / weights[candidates]
+        lines[candidates[np.argpartition(-keys, nRemaining-1)[:nRemaining]]] = True
+
+    return lines
+
+def fitDistribution(distfuncOfParam, percent, maxParam, centreBand=None, iterations=30):
+    """Finds the parameter (between 0 and maxParam) of the distribution function, for which the expected number of sampled lines 
+    (probabilities clipped to 1, centre band counted as fully sampled) is round(percent*N)
+    distfuncOfParam(param) has to return the distribution over the N lines, and it should be increasing with param
+    As it works on the 1D distribution (N values), the bisection is cheap
+    Returns the parameter and the distribution for that parameter"""
+    def expectedLines(param):
+        p = np.clip(distfuncOfParam(param), 0, 1)
+        if centreBand is not None:
+            p[centreBand] = 1
+        return p.sum()
+
+    nLines = round(percent*len(distfuncOfParam(maxParam)))
+    if expectedLines(maxParam) <= nLines:
+        param = maxParam
+    else:
+        low, high = 0, maxParam
+        for _ in range(iterations):
+            mid = (low + high) / 2
+            if expectedLines(mid) > nLines:
+                high = mid
+            else:
+                low = mid
+        param = high
+    return param, distfuncOfParam(param)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+This module provides the Mask type, returned by the Sampler for all Cartesian samplings.
+It stores the sampling pattern as a read-only bool array (1 byte per k-Space point instead of 8 with float64),
+can be bit-packed (1 bit per point) to be stored, and exposes cached views of the pattern:-
+rows, cols : indices of the rows and the columns which contain any sampled point
+keptIndices : the same as slices if they are contiguous (or the bounds of the kept rectangle, if supplied by the center masks)
+indices : flat indices of the sampled points
+fraction : sampled fraction of the k-Space
+isSymmetric : if the pattern is point-symmetric about the k-Space centre
+lineAxis : the phase-encoding axis, if the mask selects whole k-Space lines (otherwise None)
+Being an ndarray, it can still be used (and saved) as the masks were before. Results of any operation on it are plain ndarrays.
+Its copies are read-only Masks as well. Only read-only Masks cache the views, so that they can't go stale.
+
+"""
+
+import numpy as np
+from utils.FrequencyTransforms import isPointSymmetric
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+class Mask(np.ndarray):
+    def __new__(cls, mask, bounds=None):
+        obj = np.array(mask, dtype=bool).view(cls)
+        obj.flags.writeable = False #As the views are cached
+        obj.bounds = None if bounds is None else tuple((int(start), int(stop)) for start, stop in bounds)
+        return obj
+
+    def __array_finalize__(self, obj):
+        self._cache = {}
+        self.bounds = None
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, Mask) else x for x in inputs)
+        if 'out' in kwargs:
+            kwargs['out'] = tuple(np.asarray(x) if isinstance(x, Mask) else x for x in kwargs['out'])
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getitem__(self, idx):
+        return np.asarray(super().__getitem__(idx))
+
+    def __reduce__(self):
+        #Pickled as a plain bool array
+        return np.asarray(self).__reduce__()
+
+    def astype(self, dtype, *args, **kwargs):
+        return np.asarray(self).astype(dtype, *args, **kwargs)
+
+    def copy(self, order='C'):
+        #Read-only as well (with the same bounds), use np.array(mask) for a writable (plain) copy
+        return Mask(np.asarray(self).copy(order), self.bounds)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    @classmethod
+    def fromPacked(cls, packed, shape, bounds=None):
+        #Creates the mask from the bit-packed pattern (see packed)
+        return cls(np.unpackbits(np.asarray(packed, dtype=np.uint8), count=int(np.prod(shape))).reshape(shape), bounds)
+
+    def _cached(self, name, func):
+        #Only read-only masks are cached. A writable Mask (e.g. from np.empty_like) might still change, so it's computed every time
+        if self.flags.writeable:
+            return func()
+        if name not in self._cache:
+            value = func()
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            self._cache[name] = value
+        return self._cache[name]
+
+    @property
+    def packed(self):
+        return self._cached('packed', lambda: np.packbits(np.asarray(self)))
+
+    @property
+    def rows(self):
+        return self._cached('rows', lambda: np.flatnonzero(np.asarray(self).any(axis=1)))
+
+    @property
+    def cols(self):
+        return self._cached('cols', lambda: np.flatnonzero(np.asarray(self).any(axis=0)))
+
+    @property
+    def keptIndices(self):
+        #As slices when they are contiguous (no copy needed while indexing), otherwise as index arrays
+        def keptIndices():
+            if self.bounds is not None:
+                return tuple(slice(start, stop) for start, stop in self.bounds)
+            keptIdx = []
+            for idx in (self.rows, self.cols):
+                if len(idx) > 0 and idx[-1] - idx[0] + 1 == len(idx):
+                    idx = slice(int(idx[0]), int(idx[-1])+1)
+                keptIdx.append(idx)
+            return tuple(keptIdx)
+        return self._cached('keptIndices', keptIndices)
+
+    @property
+    def indices(self):
+        return self._cached('indices', lambda: np.flatnonzero(np.asarray(self)))
+
+    @property
+    def fraction(self):
+        return self._cached('fraction', lambda: len(self.indices) / self.size)
+
+    @property
+    def isSymmetric(self):
+        return self._cached('isSymmetric', lambda: isPointSymmetric(np.asarray(self)))
+
+    @property
+    def lineAxis(self):
+        def lineAxis():
+            mask = np.asarray(self)
+            if (mask == mask[:,0:1]).all():
+                return 0
+            elif (mask == mask[0:1,:]).all():
+                return 1
+            else:
+                return None
+        return self._cached('lineAxis', lineAxis)
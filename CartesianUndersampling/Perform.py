@@ -4,11 +4,26 @@
 This module performs the undersampling operation, 
 for Cartesian Sampling pattern
 
+dtype parameter (numpy.complex128 or numpy.complex64) controls the precision of the whole pipeline,
+using numpy.complex64 keeps the k-Space and the undersampled image in single precision (half of the memory)
+shiftFree parameter (default True) performs the centered transforms without the fftshift and ifftshift copies,
+using checkerboard modulation for even-sized slices and shifting the mask (once) instead of the data for odd-sized ones
+Masks which select whole k-Space lines (e.g. Varden1D, Uniform and High-frequency masks with ROdir 0 or 1) are detected,
+and the undersampling is then performed using 1D FFTs only along the phase-encoding direction, as the read-out direction transforms cancel out
+For real input images and masks which are point-symmetric about the k-Space centre, the undersampled image is also real.
+Then real FFTs are used (half of the memory and compute), and a real image is returned. Asymmetric masks keep the complex path
+With zeropad=False, only the k-Space rows and columns containing any sampled point are kept (using slices when they are contiguous,
+as with all the center masks). The k-Space is cropped directly while computing it (one axis at a time), and the inverse FFT is performed on the smaller grid
+The bounds of the kept rectangle (returned by the center masks, and by the Sampler as samplings['bounds']) can also be supplied, then they are used directly for cropping
+Masks are used as Mask (see CartesianUndersampling.Mask, returned by the Sampler), the cached views of which (kept lines, sparse indices, symmetry) are used here.
+With zeropad, performUndersamplingKSP copies only the sampled points (or lines) to the undersampled k-Space, instead of a dense float multiplication
+
 """
 
 import scipy.io as sio
 import numpy as np
-from utils.FrequencyTransforms import fft2c, ifft2c
+from utils.FrequencyTransforms import fft2c, ifft2c, fftNc, filterNc, rfilterNc
+from CartesianUndersampling.Mask import Mask
 
 __author__ = "Soumick Chatterjee"
 __copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -19,32 +34,59 @@ __version__ = "0.0.1"
 __email__ = "soumick.chatterjee@ovgu.de"
 __status__ = "Finished"
 
-def performUndersampling(fullImgVol, mask=None, maskmatpath=None, zeropad=True):
+def performUndersampling(fullImgVol, mask=None, maskmatpath=None, zeropad=True, dtype=np.complex128, shiftFree=True, bounds=None):
     #Either send mask, or maskmatpath.
     #path will only be used in mask not supplied
-    fullKSPVol = fft2c(fullImgVol)
-    underKSPVol = performUndersamplingKSP(fullKSPVol, mask, maskmatpath,zeropad)
-    underImgVol = ifft2c(underKSPVol)
+    mask = _getMask(mask, maskmatpath, bounds)
+    if zeropad and shiftFree:
+        if mask.lineAxis == 0:
+            kspFilter, axes = mask[:,0], (0,)
+        elif mask.lineAxis == 1:
+            kspFilter, axes = mask[0,:], (1,)
+        else:
+            kspFilter, axes = mask, (0,1)
+        if not np.iscomplexobj(fullImgVol) and mask.isSymmetric:
+            return rfilterNc(fullImgVol, kspFilter, axes=axes, dtype=dtype)
+        else:
+            return filterNc(fullImgVol, kspFilter, axes=axes, dtype=dtype)
+    if zeropad:
+        fullKSPVol = fft2c(fullImgVol, dtype=dtype, shiftFree=shiftFree)
+        underKSPVol = performUndersamplingKSP(fullKSPVol, mask, zeropad=zeropad)
+    else:
+        #The axis which keeps less lines is transformed (and cropped) first, so that the second transform is performed on the smallest grid
+        keptIdx = mask.keptIndices
+        nKept = [len(range(n)[idx]) if type(idx) is slice else len(idx) for idx, n in zip(keptIdx, mask.shape)]
+        axes = (0,1) if nKept[0]/mask.shape[0] <= nKept[1]/mask.shape[1] else (1,0)
+        underKSPVol = fullImgVol
+        for ax in axes:
+            underKSPVol = fftNc(underKSPVol, axes=(ax,), shiftAxes=(ax,), dtype=dtype, shiftFree=shiftFree, keepIdx=(keptIdx[ax],))
+    underImgVol = ifft2c(underKSPVol, dtype=dtype, shiftFree=shiftFree)
     return underImgVol
 
-def performUndersamplingKSP(fullKSPVol, mask=None, maskmatpath=None, zeropad=True):
+def performUndersamplingKSP(fullKSPVol, mask=None, maskmatpath=None, zeropad=True, bounds=None):
     #Either send mask, or maskmatpath.
     #path will only be used in mask not supplied
-    if mask is None:
-        mask = sio.loadmat(maskmatpath)['mask']
+    mask = _getMask(mask, maskmatpath, bounds)
     if zeropad:
-        underKSPVol = np.multiply(fullKSPVol.transpose((2,0,1)), mask).transpose((1,2,0))
+        #Only the sampled points are copied (whole lines, if the mask selects lines), instead of multiplying with a dense mask
+        underKSPVol = np.zeros(fullKSPVol.shape, dtype=fullKSPVol.dtype)
+        if mask.lineAxis == 0:
+            underKSPVol[mask.rows] = fullKSPVol[mask.rows]
+        elif mask.lineAxis == 1:
+            underKSPVol[:,mask.cols] = fullKSPVol[:,mask.cols]
+        else:
+            #Indexed without flattening, as reshape copies the k-Space if it's not C-contiguous (e.g. from NIFTIs and DICOMs)
+            rowIdx, colIdx = np.unravel_index(mask.indices, mask.shape)
+            underKSPVol[rowIdx, colIdx] = fullKSPVol[rowIdx, colIdx]
     else:
-        temp = []
-        for i in range(mask.shape[0]):
-            maskline = mask[i,:]
-            if maskline.any():
-                temp.append(fullKSPVol[i,...])
-        temp = np.array(temp)
-        underKSPVol = []
-        for i in range(mask.shape[1]):
-            maskline = mask[:,i]
-            if maskline.any():
-                underKSPVol.append(temp[:,i,...])
-        underKSPVol = np.array(underKSPVol).swapaxes(0,1)
-    return underKSPVol
\ No newline at end of file
+        rowIdx, colIdx = mask.keptIndices
+        underKSPVol = fullKSPVol[rowIdx][:,colIdx]
+    return underKSPVol
+
+def _getMask(mask, maskmatpath, bounds):
+    #Returns the mask as Mask (loaded from maskmatpath if not supplied), for its cached views
+    if mask is None:
+        mask = sio.loadmat(maskmatpath)['mask']
+    if not isinstance(mask, Mask) or (bounds is not None and mask.bounds is None):
+        mask = Mask(mask, bounds)
+    return mask
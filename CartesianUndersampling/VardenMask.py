@@ -12,9 +12,9 @@ This module can also be used for generating variable density mask in two dimensi
 """
 
 import numpy as np
+from CartesianUndersampling.LineSampler import sampleLines, fitDistribution
 import math 
 from scipy.stats import norm
-from scipy.stats import multivariate_normal as mvn
 
 __author__ = "Mariio Breitkopf, Soumick Chatterjee"
 __copyright__ = "Copyright 2019, Mario Breitkopf, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -25,27 +25,27 @@ __version__ = "0.0.1"
 __email__ = "soumick.chatterjee@ovgu.de"
 __status__ = "Finished"
 
-def createVardenMask1D(slice, percent, maxAmplitude4PDF, ROdir, returnPDF=False):  
+def createVardenMask1D(slice, percent, maxAmplitude4PDF, ROdir, returnPDF=False, seed=None):  
     mask = np.zeros(slice.shape)
     if ROdir == 2:
         percent = percent/2
         if slice.shape[0] == slice.shape[1]:
-            mask, distfunc, randseed = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 0)
-            mask, _, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 1, distfunc, randseed)
+            mask, distfunc, lines = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 0, seed=seed)
+            mask, _, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 1, distfunc, lines)
         elif slice.shape[0] > slice.shape[1]:
-            mask, distfunc, randseed = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 0)
+            mask, distfunc, lines = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 0, seed=seed)
             dim_difference = slice.shape[0] - slice.shape[1]
             _distfunc = distfunc[dim_difference//2:(slice.shape[1]+dim_difference//2)]
-            _randseed = randseed[dim_difference//2:(slice.shape[1]+dim_difference//2)]
-            mask, _, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 1, _distfunc, _randseed)
+            _lines = lines[dim_difference//2:(slice.shape[1]+dim_difference//2)]
+            mask, _, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 1, _distfunc, _lines)
         else:
-            mask, distfunc, randseed = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 1)
+            mask, distfunc, lines = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 1, seed=seed)
             dim_difference = slice.shape[1] - slice.shape[0]
             _distfunc = distfunc[dim_difference//2:(slice.shape[0]+dim_difference//2)]
-            _randseed = randseed[dim_difference//2:(slice.shape[0]+dim_difference//2)]
-            mask, _, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 0, _distfunc, _randseed)
+            _lines = lines[dim_difference//2:(slice.shape[0]+dim_difference//2)]
+            mask, _, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, 0, _distfunc, _lines)
     else:
-        mask, distfunc, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, ROdir)
+        mask, distfunc, _ = _mask1DForROdir(mask, percent, maxAmplitude4PDF, ROdir, seed=seed)
 
     if returnPDF:
         if slice.shape[0] > slice.shape[1]:
@@ -55,45 +55,35 @@ def createVardenMask1D(slice, percent, maxAmplitude4PDF, ROdir, returnPDF=False)
     else:
         return mask
 
-def _mask1DForROdir(mask, percent, maxAmplitude4PDF, ROdir, distfunc=None, randseed=None):
+def _mask1DForROdir(mask, percent, maxAmplitude4PDF, ROdir, distfunc=None, lines=None, seed=None):
     shape = mask.shape[ROdir]
-    if distfunc is None or randseed is None:
-        #Random Numbers Seed
-        randseed = np.random.random(shape)
-
+    centreBand = slice(round(shape/2-shape/round(shape/4)), round(shape/2+shape/round(shape/4)))
+    if distfunc is None or lines is None:
         #Initialize variables
         x = np.array(range(shape))
         mu = np.floor(x.size/2)
         sigma = np.floor(x.size/2)
 
-        currentPercent=1
-        while currentPercent > percent:
-            #Distribution function
-            distfunc = maxAmplitude4PDF*math.sqrt(2*math.pi)*sigma*norm.pdf(x,mu,sigma);       # 0.8 
-
-            #Selection of k-space lines
-            B = np.zeros(shape)
-            #B[randseed>distfunc] = 0
-            B[randseed<distfunc] = 1
-            B[round(shape/2-shape/round(shape/4)):round(shape/2+shape/round(shape/4))] = 1
-            currentPercent = np.count_nonzero(B)/B.size
-            sigma = np.floor(0.95*sigma)
-    else:
+        #Distribution function, with the sigma for which the expected number of lines meets the percent
+        sigma, distfunc = fitDistribution(lambda sigma: maxAmplitude4PDF*math.sqrt(2*math.pi)*sigma*norm.pdf(x,mu,sigma), percent, sigma, centreBand)       # 0.8 
+
         #Selection of k-space lines
-        B = np.zeros(shape)
-        #B[randseed>distfunc] = 0
-        B[randseed<distfunc] = 1
-        B[round(shape/2-shape/round(shape/4)):round(shape/2+shape/round(shape/4))] = 1
+        lines = sampleLines(distfunc, percent, centreBand, seed)
+    else:
+        lines = lines.copy()
+        lines[centreBand] = True
 
     if ROdir == 0:
-        mask[B==1,:] = 1
+        mask[lines,:] = 1
     else: #ROdir == 1:
-        mask[:,B==1] = 1
+        mask[:,lines] = 1
 
-    return mask, distfunc, randseed
+    return mask, distfunc, lines
 
-def createVardenMask2D(slice, percent, maxAmplitude4PDF, centrePercent=0.005, dualFWHM=False, returnPDF=False):   
+def createVardenMask2D(slice, percent, maxAmplitude4PDF, centrePercent=0.005, dualFWHM=False, returnPDF=False, seed=None):   
     #AKA Gauss Mask (New version)
+    #The random field is drawn once (using seed, if supplied). Each point gets selected once the FWHM (w1) is more than a certain threshold,
+    #so the largest w1 (starting from 2) which meets the target percentage is found directly from these thresholds, instead of shrinking w1 step by step
 
     xv, yv = np.meshgrid(np.arange(-1,1,2/slice.shape[0]), np.arange(-1,1,2/slice.shape[1]), indexing="ij")
     r = np.sqrt(0.04*(centrePercent*100)/np.pi) #converting centrePercent from 0-1 to 0-100
@@ -101,31 +91,32 @@ def createVardenMask2D(slice, percent, maxAmplitude4PDF, centrePercent=0.005, du
     # maxAmplitude4PDF = 0.3                 # 0 < a <= 1 ,tweak distribution height to influence the ksp sampling towards the edges
     w2 = 2                  # FWHM, in y direction if needed, -> comment out below
 
-    currentPercent=1     
-    while currentPercent > percent:          
+    randseed = _randomField(xv.shape, seed)
+    rr = xv**2+yv**2
+    hardcore = rr<=r**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logRatio = np.log(maxAmplitude4PDF/randseed) #randseed<u <=> threshold<w1**2
+        if dualFWHM:
+            limit = (yv**2)/w2**2 + logRatio
+            threshold = np.where(limit > 0, (4*np.log(2))*(xv**2)/limit, np.inf) # threshold for w1**2
+        else:
+            threshold = np.where(logRatio > 0, (4*np.log(2))*rr/logRatio, np.inf) # threshold for w1**2
+    w1Squared, mask = _solveWidth(hardcore, threshold, percent, w1**2)
+    w1 = np.sqrt(w1Squared)
+
+    with np.errstate(over='ignore'): #w1 can be tiny, if the hardcore alone samples more than the percent
         if dualFWHM:
             u =  maxAmplitude4PDF*np.exp(-(4*np.log(2)) * (xv**2)/w1**2 + (yv**2)/w2**2 )  # separate FWHM in x and y direction
         else:
             u =  maxAmplitude4PDF*np.exp(-(4*np.log(2)) * (xv**2+yv**2)/w1**2 )
-
-        #cast into binary mask
-        randseed = np.random.random(u.shape)
-        mask = np.zeros(u.shape)
-
-        mask[(xv**2+yv**2)<=r**2] = 1       # hardcore
-        mask[randseed<u] = 1        # softcore
-        PDF = u                             # probability density function of the non-uniform sampling
-
-        #close in on target percentage
-        currentPercent = np.count_nonzero(mask)/mask.size
-        w1 = 0.99*w1
+    PDF = u                             # probability density function of the non-uniform sampling
 
     if returnPDF:
         return mask, PDF
     else:
         return mask
 
-def createVardenMask2Dv0(slice, percent, returnPDF=False):
+def createVardenMask2Dv0(slice, percent, returnPDF=False, seed=None):
     #AKA Gauss Mask (Old version)
     
     #Xie1 = 1000
@@ -137,56 +128,72 @@ def createVardenMask2Dv0(slice, percent, returnPDF=False):
     #creates a mask that captures approximately 50% of the k-space data
     #with SIGMA old 15% -> new: compression factor Xie / (2 * pi)
 
+    #Both the distributions are isotropic normal distributions (s = 0), scaled to have the heights r1 and r2: r*exp(-d**2/(2*Xie)), 
+    #d being the distance from the centre. They are evaluated directly on the grid of distances.
+    #As in createVardenMask2D, the random field is drawn once and the largest sigma (starting from 1) which meets the target percentage is found directly
+
     sigma = 1
-    currentPercent=1
-    while currentPercent > percent:         
-        #Random Numbers Seed
-        randseed = np.random.random(slice.shape)
-        Xie1 = 5000/(2*math.pi) #Sharpness of the distribution 1, 0 <r <r0
-        Xie2 = sigma*1000000/(2*math.pi) #Sharpness of distribution 2, r0 <r <r_max
-        s = 0 #diagonal extension of distribution - / +
-        r1 = 1.3 #> = 1, Determines the size of the full coverage of the k-space center, the height of the distribution 1
-        r2 = 0.60 #<= 1, influence on the probabilities in the edge of the k-space, height of the distribution 2
-
-        #Fit to mask size
-        x1 = np.array(range(slice.shape[0]))
-        x2 = np.array(range(slice.shape[1]))     
-        X1, X2 = np.meshgrid(x1,x2) 
-
-        #Distribution function 0 <r <r0
-        mu1 = np.array([slice.shape[0]//2, slice.shape[1]//2])                         #Average
-        #Sigma1 = 1/(2*math.pi)*np.array([[Xie1,Xie1*s], [Xie1*s,Xie1]])         #Covariance matrix, alternative
-        Sigma1 = np.array([[Xie1,Xie1*s], [Xie1*s,Xie1]])                     # Covariance matrix
-        F1 = (r1*Xie1)*2*math.pi*mvn.pdf(np.array([X1.flatten(), X2.flatten()]).transpose(),mu1,Sigma1)    # 2d Normal distribution 1
-
-        F1 = np.reshape(F1,(len(x2),len(x1))).transpose()
-
-        #Distribution function r0 <r <r_max
-        mu2 = np.array([slice.shape[0]//2, slice.shape[1]//2])                        #Average
-        #Sigma2 = 1/(2*math.pi)*np.array([[Xie2,Xie2*s], [Xie2*s,Xie2]])         #Covariance matrix, alternative
-        Sigma2 = np.array([[Xie2,Xie2*s], [Xie2*s,Xie2]])                     # Covariance matrix
-        F2 = (r2*Xie2)*2*math.pi*mvn.pdf(np.array([X1.flatten(), X2.flatten()]).transpose(),mu2,Sigma2)    #2d Normal distribution 2
-
-        F2 = np.reshape(F2,(len(x2),len(x1))).transpose()
-
-        #Overlay of both distributions
-        #F = (F1 + F2)/2;
-
-        #Transfer to dot mask
-        mask = np.zeros(slice.shape)
-        #mask[A>F2] = 0 #not needed
-        #mask[A>F1] = 0 #not needed 
-        mask[randseed<F2] = 1 
-        mask[randseed<F1] = 1 
-        PDF = F1
-        idx = PDF <= F2
-        PDF[idx] = F2[idx]
-        PDF[PDF>=1] = 1
-
-        currentPercent = np.count_nonzero(mask)/mask.size
-        sigma = 0.95*sigma
+    randseed = _randomField(slice.shape, seed)
+    Xie1 = 5000/(2*math.pi) #Sharpness of the distribution 1, 0 <r <r0
+    Xie2 = sigma*1000000/(2*math.pi) #Sharpness of distribution 2, r0 <r <r_max
+    r1 = 1.3 #> = 1, Determines the size of the full coverage of the k-space center, the height of the distribution 1
+    r2 = 0.60 #<= 1, influence on the probabilities in the edge of the k-space, height of the distribution 2
+
+    #Squared distance from the centre (Average of both the distributions)
+    x1 = np.arange(slice.shape[0]) - slice.shape[0]//2
+    x2 = np.arange(slice.shape[1]) - slice.shape[1]//2
+    dd = x1[:,np.newaxis]**2 + x2[np.newaxis,:]**2
+
+    #Distribution function 0 <r <r0
+    F1 = r1*np.exp(-dd/(2*Xie1))
+
+    #Transfer to dot mask, distribution 2 for the largest Xie2 which meets the target percentage
+    with np.errstate(divide='ignore'):
+        logRatio = np.log(r2/randseed) #randseed<F2 <=> threshold<Xie2
+        threshold = np.where(logRatio > 0, dd/(2*logRatio), np.inf) # threshold for Xie2
+    Xie2, mask = _solveWidth(randseed<F1, threshold, percent, Xie2)
+
+    #Distribution function r0 <r <r_max
+    with np.errstate(over='ignore'): #Xie2 can be tiny, if distribution 1 alone samples more than the percent
+        F2 = r2*np.exp(-dd/(2*Xie2))
+
+    #Overlay of both distributions
+    PDF = np.maximum(F1, F2)
+    PDF[PDF>=1] = 1
 
     if returnPDF:
         return mask, PDF
     else:
-        return mask
\ No newline at end of file
+        return mask
+
+def _randomField(shape, seed=None):
+    #Uniformly distributed random numbers, reproducible if seed is supplied
+    if seed is None:
+        return np.random.random(shape)
+    else:
+        return np.random.default_rng(seed).random(shape)
+
+def _solveWidth(fixedMask, threshold, percent, maxWidth):
+    #Finds the largest width (not more than maxWidth) for which the mask (fixedMask | threshold<width) samples not more than the given percent of the points
+    #The sampled count only grows with the width, each point joining when the width crosses its threshold, 
+    #so the width is read directly from the sorted thresholds (one partition pass) instead of searching for it
+    size = fixedMask.size
+    nAllowed = int(np.floor(percent*size))
+    while (nAllowed+1)/size <= percent:
+        nAllowed += 1
+    while nAllowed > 0 and nAllowed/size > percent:
+        nAllowed -= 1
+
+    freeThresholds = threshold[~fixedMask]
+    nFree = nAllowed - np.count_nonzero(fixedMask)
+    if nFree < 0: #even the fixed part alone samples more than the percent, smallest possible width
+        width = np.finfo(float).tiny
+    elif nFree >= freeThresholds.size:
+        width = maxWidth
+    else:
+        width = min(maxWidth, np.partition(freeThresholds, nFree)[nFree])
+
+    mask = np.zeros(fixedMask.shape)
+    mask[fixedMask] = 1
+    mask[threshold<width] = 1
+    return width, mask
@@ -2,12 +2,15 @@
 
 """
 This module generates radial sampling pattern following Golden Angle Scheme
+All the spokes are created at once (broadcasting the angles over the sample positions),
+and the full resolution (and the inverse) trajectories and DCFs are only created if they are requested
+With iterativeDCF, the DCFs are computed iteratively for the trajectories (see RadialUndersampling.dcf) instead of the analytic ramp
 
 """
 
 import math
 import numpy as np
-from RadialUndersampling.dcf import generateDCF
+from RadialUndersampling.dcf import generateDCF, generateIterativeDCF
 
 __author__ = "Mariio Breitkopf, Soumick Chatterjee"
 __copyright__ = "Copyright 2019, Mario Breitkopf, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -18,39 +21,54 @@ __version__ = "0.0.1"
 __email__ = "soumick.chatterjee@ovgu.de"
 __status__ = "Finished"
 
-def createGASampling(slice, noOfSpokes, fullresSpokesMulFactor=2, returnFullOM=True, returnInvOM=True):
+def createGASampling(slice, noOfSpokes, fullresSpokesMulFactor=2, returnFullOM=True, returnInvOM=True, iterativeDCF=False, dcfIterations=10):
     baseresolution = slice.shape[0]
     fullspokes = baseresolution * fullresSpokesMulFactor
     baseresolution = baseresolution * 2
 
-    fullom = np.zeros((baseresolution*fullspokes,2))
-    i=0
-    inc = 111.246117975
-    for s in range(fullspokes):
-        b = math.pi*math.cos(np.deg2rad(np.mod(inc*s,360)))
-        a = math.pi*math.sin(np.deg2rad(np.mod(inc*s,360)))
-        x = np.linspace(-a, a, baseresolution)
-        y = np.linspace(-b, b, baseresolution)
-        fullom[i*baseresolution:baseresolution+i*baseresolution,0] = x
-        fullom[i*baseresolution:baseresolution+i*baseresolution,1] = y
-        i = i+1
-
-    under_om_element = baseresolution * noOfSpokes
-    om = fullom[0:under_om_element,:]
-    dcf = generateDCF(noOfSpokes, baseresolution)
+    #Only the spokes which are requested are created (the full resolution trajectory only if returnFullOM, the rest of it only if returnInvOM)
+    if returnFullOM:
+        fullom = _createSpokes(0, fullspokes, baseresolution)
+        om = fullom[0:baseresolution*noOfSpokes,:]
+    else:
+        om = _createSpokes(0, noOfSpokes, baseresolution)
+    dcf = _generateDCF(om, noOfSpokes, baseresolution, iterativeDCF, dcfIterations)
 
     omtuple = (om,)
     dcftuple = (dcf,)
 
     if returnFullOM:
-        dcfFullRes = generateDCF(fullspokes, baseresolution)
+        dcfFullRes = _generateDCF(fullom, fullspokes, baseresolution, iterativeDCF, dcfIterations)
         omtuple += (fullom,)
         dcftuple += (dcfFullRes,)
 
     if returnInvOM:
-        invom = fullom[under_om_element:,:]
-        dcfInvRes = generateDCF(fullspokes-noOfSpokes, baseresolution)
+        invom = fullom[om.shape[0]:,:] if returnFullOM else _createSpokes(noOfSpokes, fullspokes, baseresolution)
+        dcfInvRes = _generateDCF(invom, fullspokes-noOfSpokes, baseresolution, iterativeDCF, dcfIterations)
         omtuple += (invom,)
         dcftuple += (dcfInvRes,)
 
-    return omtuple, dcftuple
\ No newline at end of file
+    return omtuple, dcftuple
+
+def _generateDCF(om, spokes, baseresolution, iterativeDCF, dcfIterations):
+    #Analytic ramp, or the iterative DCF (Pipe & Menon) computed for the trajectory
+    if iterativeDCF:
+        return generateIterativeDCF(om, spokes, baseresolution, dcfIterations)
+    else:
+        return generateDCF(spokes, baseresolution)
+
+def _createSpokes(start, stop, baseresolution):
+    #Trajectory of the spokes from start till stop (spoke s at the angle s times the golden angle), baseresolution points each, all at once
+    inc = 111.246117975
+    angles = np.deg2rad(np.mod(inc*np.arange(start, stop), 360))
+    om = np.empty((stop-start, baseresolution, 2))
+    _linspace(math.pi*np.sin(angles), om[...,0])
+    _linspace(math.pi*np.cos(angles), om[...,1])
+    return om.reshape(-1, 2)
+
+def _linspace(ends, out):
+    #Same as np.linspace(-end, end, num) for each of the ends, written into the rows of out (number of ends x num)
+    ends = ends[:, np.newaxis]
+    np.multiply(np.arange(out.shape[1]), (ends - -ends) / (out.shape[1] - 1), out=out)
+    out -= ends
+    out[:, -1] = ends[:, 0]
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+This module provides the built-in NUFFT engine: Kaiser-Bessel gridding, with a precomputed scipy.sparse (CSR) interpolation matrix.
+It follows the same conventions as pynufft (om in radians between -pi and pi, image centred at Nd/2, the image zero-padded to Kd for the oversampled FFT),
+and has the same attributes used for the transforms (Nd, Kd, dtype, sn: scaling factors, sp: interpolation matrix and spH: its adjoint),
+so the plans of both the engines can be used the same way (see RadialUndersampling.NUFFTPlans and RadialUndersampling.Perform).
+The FFTs are performed by the active FFT backend (see utils.FFTBackends.setBackend).
+The grid oversampling ratio is Kd/Nd (any ratio, the kernel shape is chosen for it following Beatty et al. 2005)
+and the precision is selectable with dtype (np.complex64 or np.complex128)
+
+"""
+
+import numpy as np
+import scipy.sparse
+from utils.FFTBackends import getBackend
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+class KBNUFFT(object):
+    def __init__(self, om, Nd, Kd, Jd, dtype=np.complex64):
+        self.Nd = tuple(Nd)
+        self.Kd = tuple(Kd)
+        self.Jd = tuple(Jd)
+        self.dtype = dtype
+        realDtype = np.finfo(dtype).dtype
+        om = np.asarray(om, dtype=np.float64)
+
+        #Scaling factors (inverse of the Fourier transform of the kernel, over the image), and the weights and the indices of the grid neighbours for each dim
+        self.sn = np.ones(self.Nd, dtype=realDtype)
+        weights = np.ones((len(om), 1), dtype=np.complex128)
+        cols = np.zeros((len(om), 1), dtype=np.int64)
+        for d, (N, K, J) in enumerate(zip(self.Nd, self.Kd, self.Jd)):
+            beta = kaiserBesselBeta(J, K/N)
+            shape = [1] * len(self.Nd)
+            shape[d] = N
+            self.sn *= (1 / _kaiserBesselFT(np.arange(N) - N/2, J, K, beta)).reshape(shape).astype(realDtype)
+
+            u = om[:, d] * K / (2*np.pi) #position on the grid
+            k = np.floor(u - J/2).astype(np.int64)[:, np.newaxis] + np.arange(1, J+1) #J nearest grid points
+            w = _kaiserBessel(u[:, np.newaxis] - k, J, beta) * np.exp(1j*np.pi*k*N/K) #phase for the image centre at N/2
+            weights = (weights[:, :, np.newaxis] * w[:, np.newaxis, :]).reshape(len(om), -1)
+            cols = (cols[:, :, np.newaxis] * K + np.mod(k, K)[:, np.newaxis, :]).reshape(len(om), -1)
+
+        rows = np.repeat(np.arange(len(om)), cols.shape[1])
+        self.sp = scipy.sparse.csr_matrix((weights.ravel().astype(dtype), (rows, cols.ravel())), shape=(len(om), int(np.prod(self.Kd))))
+        self.spH = self.sp.getH().tocsr()
+
+    def forward(self, x):
+        #Same as NUFFT.forward of pynufft: from image (Nd) to the non-Cartesian k-Space (M,)
+        k = np.zeros(self.Kd, dtype=self.dtype)
+        k[tuple(slice(0, N) for N in self.Nd)] = x * self.sn
+        return self.sp.dot(getBackend().fftn(k).ravel())
+
+    def adjoint(self, y):
+        #Same as NUFFT.adjoint of pynufft: from the non-Cartesian k-Space (M,) to image (Nd)
+        k = getBackend().ifftn(self.spH.dot(y).reshape(self.Kd)).astype(self.dtype, copy=False)
+        return k[tuple(slice(0, N) for N in self.Nd)] * self.sn
+
+def kaiserBesselBeta(J, oversamplingRatio):
+    #Shape parameter of the kernel for the width J and the oversampling ratio (Beatty et al. 2005)
+    return np.pi * np.sqrt((J / oversamplingRatio)**2 * (oversamplingRatio - 0.5)**2 - 0.8)
+
+def _kaiserBessel(d, J, beta):
+    #Kernel, at the distance d (in grid points)
+    arg = 1 - (2*d/J)**2
+    return np.where(arg >= 0, np.i0(beta * np.sqrt(np.maximum(arg, 0))), 0)
+
+def _kaiserBesselFT(x, J, K, beta):
+    #Fourier transform of the kernel, at the image position x (relative to the image centre)
+    z = np.sqrt((beta**2 - (np.pi*J*x/K)**2).astype(np.complex128))
+    return (J * np.sinh(z) / z).real
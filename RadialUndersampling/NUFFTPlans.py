@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+This module caches the NUFFT plans for the radial undersampling.
+Planning is much more expensive than the transforms themselves, and the trajectory (om) is usually the same for the whole run.
+Plans are kept in memory with LRU eviction (maxPlans), keyed by a hash of the trajectory together with Nd, Kd, Jd, the engine and the dtype.
+Engines:-
+pynufft : NUFFT of pynufft (always single precision)
+kb : the built-in Kaiser-Bessel gridding NUFFT (see RadialUndersampling.KBNUFFT), supporting any grid oversampling ratio and both np.complex64 and np.complex128
+If cacheDir is set (see setPlanCache), the plans are also pickled there,
+so that any other process (or a later run) with the same trajectory loads the plan instead of planning it again
+The kernels of the Toeplitz operators (see getToeplitzKernel) are cached the same way, keyed also by a hash of the dcf,
+and so are the iterative DCFs (see RadialUndersampling.dcf)
+
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+from RadialUndersampling.KBNUFFT import KBNUFFT
+from utils.FFTBackends import getBackend
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+_plans = OrderedDict()
+_maxPlans = 4
+_cacheDir = None
+
+def setPlanCache(maxPlans=4, cacheDir=None):
+    #maxPlans: number of plans (and Toeplitz kernels) kept in memory, cacheDir: folder to store the plans to (and load from). None or '' to only keep them in memory
+    global _maxPlans, _cacheDir
+    _maxPlans = maxPlans
+    _cacheDir = cacheDir if cacheDir else None
+    if _cacheDir is not None:
+        os.makedirs(_cacheDir, exist_ok=True)
+    while len(_plans) > _maxPlans:
+        _plans.popitem(last=False)
+
+def clearPlanCache():
+    #Only clears the plans in memory
+    _plans.clear()
+
+def trajectoryHash(om):
+    #Also used for the dcf
+    om = np.ascontiguousarray(om)
+    h = hashlib.sha1(str((om.shape, om.dtype.str)).encode())
+    h.update(om.tobytes())
+    return h.hexdigest()
+
+def _pynufftPlan(om, Nd, Kd, Jd, dtype):
+    from pynufft import NUFFT
+    NufftObj = NUFFT()
+    NufftObj.plan(om, Nd, Kd, Jd)
+    return NufftObj
+
+_engines = {
+    'pynufft': _pynufftPlan,
+    'kb': KBNUFFT,
+}
+
+def availableEngines():
+    return list(_engines.keys())
+
+def getPlan(om, Nd, Kd, Jd, engine='pynufft', dtype=np.complex64):
+    #Returns the NUFFT object planned for om, Nd, Kd, Jd, using the engine. From the cache if available, otherwise it's planned and cached
+    assert engine in _engines, 'Unrecognized NUFFT engine, available: ' + str(availableEngines())
+    if engine == 'pynufft':
+        dtype = np.complex64
+    key = (trajectoryHash(om), tuple(Nd), tuple(Kd), tuple(Jd), engine, np.dtype(dtype).str)
+    return getCached(key, lambda: _engines[engine](om, tuple(Nd), tuple(Kd), tuple(Jd), dtype))
+
+def getToeplitzKernel(om, dcf, Nd, Kd, Jd, engine='pynufft', dtype=np.complex64):
+    #Returns the FFT of the kernel of the Toeplitz operator A^H.D.A (A: NUFFT of the trajectory, D: dcf), circulantly embedded in the Nd grid
+    #It's valid for images of (up to) half of Nd, placed at the top-left corner of the Nd grid. Computed once with the adjoint NUFFT of the dcf, and cached like the plans
+    key = ('toeplitz', trajectoryHash(om), trajectoryHash(dcf), tuple(Nd), tuple(Kd), tuple(Jd), engine, np.dtype(dtype).str)
+    return getCached(key, lambda: _toeplitzKernel(getPlan(om, Nd, Kd, Jd, engine, dtype), dcf))
+
+def _toeplitzKernel(NufftObj, dcf):
+    #The adjoint of the dcf is the kernel at the offsets -Nd/2 to Nd/2-1 (the centre of the grid is offset 0), ifftshift makes it circulant
+    kernel = NufftObj.adjoint(np.asarray(dcf).ravel().astype(NufftObj.dtype))
+    kernel = getBackend().fft2(np.fft.ifftshift(kernel)).astype(NufftObj.dtype, copy=False)
+    kernel.flags.writeable = False
+    return kernel
+
+def getCached(key, build):
+    #From the memory if available, otherwise from the cacheDir, otherwise it's built (and stored in the cacheDir)
+    #Used for the plans and for everything computed from them (e.g. the Toeplitz kernels and the iterative DCFs), key has to be unique for each of them
+    if key in _plans:
+        _plans.move_to_end(key)
+        return _plans[key]
+
+    value = _loadPlan(key)
+    if value is None:
+        value = build()
+        _savePlan(key, value)
+
+    _plans[key] = value
+    while len(_plans) > _maxPlans:
+        _plans.popitem(last=False)
+    return value
+
+def _planPath(key):
+    return os.path.join(_cacheDir, 'nufft_' + hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl')
+
+def _loadPlan(key):
+    if _cacheDir is None or not os.path.isfile(_planPath(key)):
+        return None
+    try:
+        with open(_planPath(key), 'rb') as f:
+            return pickle.load(f)
+    except Exception as ex:
+        print('NUFFT plan could not be loaded from the cache, will be planned again: ' + str(ex))
+        return None
+
+def _savePlan(key, NufftObj):
+    if _cacheDir is None:
+        return
+    #Written to a temporary file first and then renamed, so that other processes never read a partly written plan
+    fd, tmpPath = tempfile.mkstemp(dir=_cacheDir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(NufftObj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, _planPath(key))
+    except Exception as ex:
+        print('NUFFT plan could not be stored in the cache: ' + str(ex))
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
@@ -3,12 +3,22 @@
 """
 This module performs the undersampling operation, 
 for Radial Sampling pattern
+The NUFFT plans are cached (see RadialUndersampling.NUFFTPlans), so they are not planned again for every volume (or coil) with the same trajectory
+All the slices (and coils, if present) are undersampled together in batches: the oversampled FFTs are performed as batched transforms (skipping the rows which are known to be zero or not needed),
+and the interpolation (and gridding) as sparse matrix x dense matrix products with the interpolation matrix of the plan
+With toeplitz=True, the NUFFTs are not performed for each slice. As A^H.D.A (A: NUFFT, D: dcf) is a convolution for a given trajectory and dcf,
+its kernel is computed once (and cached) for each om, dcf and grid, and every slice is then undersampled with just two batched FFTs on the 2x padded grid
+The image padding (padFactor) and the k-Space grid oversampling (oversamplingRatio) of the NUFFT are separate parameters (see getGrids).
+The padding doesn't change the result, and lower oversampling ratios need wider kernels (interpolationSize4NUFFT) for the same accuracy (see reportTradeoff)
+performUndersamplingKSP returns the sampled (non-Cartesian) k-Space itself, performing only the forward NUFFT. It can also be streamed to the disk
 
 """
 
+import math
 import scipy.io as sio
 import numpy as np
-from pynufft import NUFFT
+from RadialUndersampling.NUFFTPlans import getPlan, getToeplitzKernel
+from utils.FFTBackends import getBackend
 
 __author__ = "Soumick Chatterjee"
 __copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -19,34 +29,144 @@ __version__ = "0.0.1"
 __email__ = "soumick.chatterjee@ovgu.de"
 __status__ = "Finished"
 
-def performUndersampling(fullImgVol, om=None, dcf=None, interpolationSize4NUFFT=6, complex2real = np.abs, ommatpath=None):
+batchSizeBytes = 2**28 #Upper limit of the memory for the oversampled k-Space grids of one batch of slices
+toeplitzPadFactor = 2 #The Toeplitz kernel needs all the offsets between the pixels, so its grid is always 2x padded (whatever the padFactor)
+
+def performUndersampling(fullImgVol, om=None, dcf=None, interpolationSize4NUFFT=6, complex2real = np.abs, ommatpath=None, nufftEngine='pynufft', nufftDtype=np.complex64, toeplitz=False, padFactor=1, oversamplingRatio=2, kspOut=None):
     #Either send om and dcf, or ommatpath.
     #path will only be used in om not supplied
+    #fullImgVol can also have more than one dim after the slices (e.g. coils), all of them are undersampled together. Slices can be rectangular
+    #nufftEngine: 'pynufft' or 'kb' (built-in Kaiser-Bessel NUFFT), nufftDtype: precision of the NUFFT (only used by 'kb', pynufft is always np.complex64)
+    #toeplitz: to use the Toeplitz operator (the NUFFT is only used once, to compute its kernel) instead of performing the NUFFTs for each slice
+    #padFactor: the image is zero-padded by this factor for the NUFFT, oversamplingRatio: the k-Space grid of the NUFFT is this times the padded image
+    #(see getGrids, and reportTradeoff for the accuracy and the memory for different values)
+    #kspOut: if supplied (array of M x the dims after the slices), the sampled k-Space is also written into it (see performUndersamplingKSP)
     if om is None:
         temp_mat =  sio.loadmat(ommatpath)
         om = temp_mat['om']
         dcf = temp_mat['dcf'].squeeze()
 
-    imageSize = fullImgVol.shape[0]
-    baseresolution = imageSize*2
+    #All slices (and coils) as columns, undersampled in batches
+    fullSlices = fullImgVol.reshape(fullImgVol.shape[:2] + (-1,))
+    underImgVol = np.zeros(fullImgVol.shape, dtype=fullImgVol.dtype)
+    underSlices = underImgVol.reshape(fullSlices.shape)
+
+    if toeplitz:
+        if kspOut is not None: #Not computed by the Toeplitz operator
+            performUndersamplingKSP(fullImgVol, om, interpolationSize4NUFFT, nufftEngine=nufftEngine, nufftDtype=nufftDtype, padFactor=padFactor, oversamplingRatio=oversamplingRatio, out=kspOut)
+        Nd, Kd, Jd, _ = getGrids(fullImgVol.shape[:2], toeplitzPadFactor, oversamplingRatio, interpolationSize4NUFFT)
+        kernel = getToeplitzKernel(om, dcf, Nd, Kd, Jd, nufftEngine, nufftDtype) * _scaling(fullImgVol.shape[:2], Kd) #computed only once for each trajectory and dcf
+        nBatch = max(1, batchSizeBytes // (np.prod(Nd) * np.dtype(np.complex128).itemsize))
+        for start in range(0, fullSlices.shape[-1], nBatch):
+            batch = slice(start, start+nBatch)
+            underSlices[..., batch] = complex2real(_toeplitz(kernel, fullSlices[..., batch]))
+        return underImgVol
 
-    NufftObj = NUFFT()
+    Nd, Kd, Jd, crop = getGrids(fullImgVol.shape[:2], padFactor, oversamplingRatio, interpolationSize4NUFFT)
+    NufftObj = getPlan(om, Nd, Kd, Jd, nufftEngine, nufftDtype) #planned only once for each trajectory (see RadialUndersampling.NUFFTPlans)
 
-    Nd = (baseresolution, baseresolution)  # image size
-    Kd = (baseresolution*2, baseresolution*2)  # k-space size 
-    Jd = (interpolationSize4NUFFT, interpolationSize4NUFFT)  # interpolation size
+    #The image is placed at the centre of the zero-padded grid, so only that part of the grid is ever non-zero
+    sn = NufftObj.sn[crop][..., np.newaxis]
+    dcf = np.asarray(dcf).reshape(-1, 1) * _scaling(fullImgVol.shape[:2], Kd)
 
-    NufftObj.plan(om, Nd, Kd, Jd)
+    kspSlices = None if kspOut is None else kspOut.reshape(kspOut.shape[0], -1)
+    nBatch = max(1, batchSizeBytes // (np.prod(Kd) * np.dtype(np.complex128).itemsize))
+    for start in range(0, fullSlices.shape[-1], nBatch):
+        batch = slice(start, start+nBatch)
+        y = _forward(NufftObj, fullSlices[..., batch], sn, crop)
+        if kspSlices is not None:
+            kspSlices[:, batch] = y
+        y *= dcf
+        underSlices[..., batch] = complex2real(_adjoint(NufftObj, y, sn, crop))
 
-    underImgVol = np.zeros(fullImgVol.shape, dtype=fullImgVol.dtype)
-    for i in range(fullImgVol.shape[-1]):
-        oversam_fully = np.zeros((baseresolution,baseresolution), dtype=fullImgVol.dtype)
-        oversam_fully[imageSize//2:imageSize+imageSize//2,imageSize//2:imageSize+imageSize//2] = fullImgVol[...,i]
+    return underImgVol
+
+def performUndersamplingKSP(fullImgVol, om=None, interpolationSize4NUFFT=6, ommatpath=None, nufftEngine='pynufft', nufftDtype=np.complex64, padFactor=1, oversamplingRatio=2, out=None):
+    #Returns the sampled (non-Cartesian) k-Space of all the slices (and coils), as M (number of points in om) x the dims after the slices, in np.complex64
+    #Only the forward NUFFT is performed (no dcf, no adjoint), for the rest of the params see performUndersampling
+    #out: array to write the k-Space into (e.g. np.lib.format.open_memmap, to stream it to the disk batch by batch), otherwise it's created
+    if om is None:
+        om = sio.loadmat(ommatpath)['om']
+
+    fullSlices = fullImgVol.reshape(fullImgVol.shape[:2] + (-1,))
+    if out is None:
+        out = np.zeros((om.shape[0],) + fullImgVol.shape[2:], dtype=np.complex64)
+    kspSlices = out.reshape(out.shape[0], -1)
+
+    Nd, Kd, Jd, crop = getGrids(fullImgVol.shape[:2], padFactor, oversamplingRatio, interpolationSize4NUFFT)
+    NufftObj = getPlan(om, Nd, Kd, Jd, nufftEngine, nufftDtype)
+    sn = NufftObj.sn[crop][..., np.newaxis]
+
+    nBatch = max(1, batchSizeBytes // (np.prod(Kd) * np.dtype(np.complex128).itemsize))
+    for start in range(0, fullSlices.shape[-1], nBatch):
+        batch = slice(start, start+nBatch)
+        kspSlices[:, batch] = _forward(NufftObj, fullSlices[..., batch], sn, crop)
+
+    return out
+
+def getGrids(imageShape, padFactor=1, oversamplingRatio=2, interpolationSize4NUFFT=6):
+    #Returns Nd (padded image size), Kd (k-Space grid size), Jd (interpolation size) and crop (slices of the image inside the padded image)
+    #om is in radians per pixel, so the padding doesn't change the result (as long as the image stays at the centre), only the cost.
+    #The image is padded evenly on both sides, so that its centre stays at the centre of the padded image
+    Nd = tuple(N + 2*int(round((padFactor-1)*N/2)) for N in imageShape)
+    Kd = tuple(int(math.ceil(oversamplingRatio*N)) for N in Nd)
+    Jd = (interpolationSize4NUFFT,) * len(imageShape)
+    crop = tuple(slice((P-N)//2, (P-N)//2+N) for N, P in zip(imageShape, Nd))
+    return Nd, Kd, Jd, crop
+
+def _scaling(imageShape, Kd):
+    #The adjoint NUFFT is scaled by 1/prod(Kd). So that the result doesn't depend on the grid, it's scaled as with a 4x k-Space grid (the original 2x padding, and 2x oversampling)
+    return float(np.prod(Kd) / np.prod([4*N for N in imageShape]))
+
+def reportTradeoff(om, imageShape, interpolationSize4NUFFT=6, padFactor=1, oversamplingRatio=2, nufftEngine='pynufft', nufftDtype=np.complex64, nSamples=256):
+    #Reports the accuracy and the memory of the NUFFT for the given parameters
+    #Accuracy: relative error of the forward NUFFT of a random image, against the exact non-uniform DFT at (upto) nSamples points of om
+    Nd, Kd, Jd, crop = getGrids(imageShape, padFactor, oversamplingRatio, interpolationSize4NUFFT)
+    NufftObj = getPlan(om, Nd, Kd, Jd, nufftEngine, nufftDtype)
+
+    rng = np.random.default_rng(0)
+    x = np.zeros(Nd)
+    x[crop] = rng.random(tuple(imageShape))
+    samples = rng.choice(len(om), min(nSamples, len(om)), replace=False)
+    exact = np.zeros(len(samples), dtype=np.complex128)
+    n = [np.arange(N) - N/2 for N in Nd]
+    for i, m in enumerate(samples):
+        exact[i] = np.exp(-1j*om[m,0]*n[0]) @ x @ np.exp(-1j*om[m,1]*n[1])
+    error = np.abs(NufftObj.forward(x)[samples] - exact).max() / np.abs(exact).max()
+
+    gridMB = np.prod(Kd) * np.dtype(np.complex128).itemsize / 2**20
+    interpolatorMB = sum(a.nbytes for sp in (NufftObj.sp, NufftObj.spH) for a in (sp.data, sp.indices, sp.indptr)) / 2**20
+    report = {'Nd': Nd, 'Kd': Kd, 'Jd': Jd, 'relativeError': error, 'gridMBPerSlice': gridMB, 'interpolatorMB': interpolatorMB}
+    print('NUFFT (%s) Nd=%s Kd=%s Jd=%s: relative error %.1e, k-Space grid %.1f MB per slice, interpolation matrices %.1f MB' % 
+          (nufftEngine, Nd, Kd, Jd, error, gridMB, interpolatorMB))
+    return report
 
-        y = NufftObj.forward(oversam_fully)
-        y = np.multiply(dcf,y)
-        oversam_under = NufftObj.adjoint(y)
+def _forward(NufftObj, x, sn, crop):
+    #NUFFT (same as NufftObj.forward) of all the columns (last dim) of x together
+    #The oversampled FFTs are performed as batched transforms, and the interpolation as one sparse matrix x dense matrix product
+    #Only the rows containing the image are non-zero, so the first (row-wise) FFT is performed only on them
+    k = np.zeros(NufftObj.Kd + x.shape[-1:], dtype=NufftObj.dtype)
+    k[crop] = x * sn
+    k[crop[0]] = getBackend().fft(k[crop[0]], axis=1)
+    k = getBackend().fft(k, axis=0)
+    return NufftObj.sp.dot(k.reshape(-1, x.shape[-1]))
 
-        underImgVol[...,i] = complex2real(oversam_under[imageSize//2:imageSize+imageSize//2,imageSize//2:imageSize+imageSize//2])
+def _adjoint(NufftObj, y, sn, crop):
+    #Adjoint NUFFT (same as NufftObj.adjoint) of all the columns of y together, only the cropped part of the image is returned
+    #So, the second (row-wise) inverse FFT is performed only on the rows of the cropped part
+    k = NufftObj.spH.dot(y).astype(NufftObj.dtype, copy=False).reshape(NufftObj.Kd + y.shape[-1:]) #in the precision of the plan
+    k = getBackend().ifft(k, axis=0)[crop[0]]
+    k = getBackend().ifft(k, axis=1)[:, crop[1]]
+    return k * sn
 
-    return underImgVol
\ No newline at end of file
+def _toeplitz(kernel, x):
+    #A^H.D.A of all the columns of x together: convolution with the kernel (FFT of it, circulantly embedded in the 2x padded grid)
+    #The image is placed at the top-left corner of the grid, so only its rows are transformed first, and only they are needed after the inverse transform
+    N = x.shape[:2]
+    k = np.zeros(kernel.shape + x.shape[-1:], dtype=kernel.dtype)
+    k[:N[0], :N[1]] = x
+    k[:N[0]] = getBackend().fft(k[:N[0]], axis=1)
+    k = getBackend().fft(k, axis=0)
+    k *= kernel[..., np.newaxis]
+    k = getBackend().ifft(k, axis=0)[:N[0]]
+    return getBackend().ifft(k, axis=1)[:, :N[1]]
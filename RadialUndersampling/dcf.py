@@ -2,10 +2,15 @@
 
 """
 This module creates density compensation function for radial samplings
+generateDCF: analytic ramp (the same for all the spokes)
+generateIterativeDCF: iterative DCF (Pipe & Menon 1999), using the interpolation matrix of the NUFFT plan of the trajectory.
+It accounts for the non-uniformity of the spokes (e.g. of golden angle), and is computed only once for each trajectory and grid
+(cached in memory and, if set, on the disk, see RadialUndersampling.NUFFTPlans)
 """
 
 import math
 import numpy as np
+from RadialUndersampling.NUFFTPlans import getPlan, getCached, trajectoryHash
 
 __author__ = "Mariio Breitkopf, Soumick Chatterjee"
 __copyright__ = "Copyright 2019, Mario Breitkopf, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -17,9 +22,26 @@ __email__ = "soumick.chatterjee@ovgu.de"
 __status__ = "Finished"
 
 def generateDCF(spokes, baseresolution):
-    dcfRow=np.ones((baseresolution,1))
-    for i in range(baseresolution):
-       dcfRow[i]=np.abs(baseresolution/2-(i-0.5))
-    dcfRow=math.pi/spokes*dcfRow
-    dcf=np.tile(dcfRow,(spokes,1)).transpose()
-    return dcf
\ No newline at end of file
+    #Ramp (same for all the spokes), as one row (1 x spokes*baseresolution)
+    dcfRow = math.pi/spokes*np.abs(baseresolution/2-(np.arange(baseresolution)-0.5))
+    dcf = np.tile(dcfRow, spokes)[np.newaxis, :]
+    return dcf
+
+def generateIterativeDCF(om, spokes, baseresolution, iterations=10, interpolationSize=6, oversamplingRatio=2, engine='kb'):
+    #For the trajectory om of the spokes (baseresolution points each), using the NUFFT for the image of baseresolution/2 (as in createGASampling)
+    #Scaled to have the same sum as the analytic ramp (generateDCF), to keep the intensities of the undersampled images comparable
+    Nd = (baseresolution//2, baseresolution//2)
+    Kd = tuple(int(math.ceil(oversamplingRatio*N)) for N in Nd)
+    Jd = (interpolationSize, interpolationSize)
+    key = ('dcf', trajectoryHash(om), Nd, Kd, Jd, engine, iterations)
+    dcf = getCached(key, lambda: pipeMenonDCF(getPlan(om, Nd, Kd, Jd, engine), iterations))
+    rampSum = math.pi*np.abs(baseresolution/2-(np.arange(baseresolution)-0.5)).sum()
+    return (dcf * (rampSum / dcf.sum()))[np.newaxis, :]
+
+def pipeMenonDCF(NufftObj, iterations=10):
+    #w = w / |G.G^H.w|, G being the interpolation matrix (sp) of the NUFFT plan. Fixed number of iterations, two sparse matrix-vector products each
+    dcf = np.ones(NufftObj.sp.shape[0])
+    for _ in range(iterations):
+        dcf = dcf / np.abs(NufftObj.sp.dot(NufftObj.spH.dot(dcf.astype(NufftObj.sp.dtype))))
+    dcf.flags.writeable = False
+    return dcf
@@ -12,6 +12,7 @@ from CartesianUndersampling.CenterMask import *
 from CartesianUndersampling.UniformMask import *
 from CartesianUndersampling.VardenMask import *
 from CartesianUndersampling.HighFrequencyMask import *
+from CartesianUndersampling.Mask import Mask
 from RadialUndersampling.GoldenAngle import *
 
 
@@ -28,7 +29,7 @@ __status__ = "Finished"
 class Sampler(object):
     """description of class"""
 
-    def __init__(self, undersamplingType, percentOfKSpace, centrePercent, stepsize, lines2ignore, maxAmplitude4PDF, ROdir, noOfSpokes, fullresSpokesMulFactor, interpolationSize, sliceShape=None):
+    def __init__(self, undersamplingType, percentOfKSpace, centrePercent, stepsize, lines2ignore, maxAmplitude4PDF, ROdir, noOfSpokes, fullresSpokesMulFactor, interpolationSize, sliceShape=None, returnFullInvOM=True, iterativeDCF=False, dcfIterations=10):
         assert undersamplingType in list(range(0,7+1))+list(range(10,11+1)), 'Unrecognized undersamplingType'
         assert 0 <= percentOfKSpace <= 1, 'Invalid percentOfKSpace'
         assert 0 <= centrePercent <= 1, 'Invalid centrePercent'
@@ -47,6 +48,9 @@ class Sampler(object):
         self.ROdir = ROdir
         self.noOfSpokes = noOfSpokes
         self.fullresSpokesMulFactor = fullresSpokesMulFactor
+        self.iterativeDCF = iterativeDCF #If the DCFs are to be computed iteratively (Pipe & Menon) instead of the analytic ramp, for radial samplings
+        self.dcfIterations = dcfIterations
+        self.returnFullInvOM = returnFullInvOM #If the full resolution and the inverse trajectories (and DCFs) are also to be created, for radial samplings
         self.interpolationSize = interpolationSize
 
         self.MasksWOMetaReturn = [3] #This should contain the list of undersamplingTypes which doesn't return any meta
@@ -67,6 +71,7 @@ class Sampler(object):
             slice = self.dummySlice
         
         samplings = {}
+        bounds = None
         if self.undersamplingType == 0: #Varden1D
             data = createVardenMask1D(slice, self.percentOfKSpace, self.maxAmplitude4PDF, self.ROdir, returnMeta)
             metaname = 'PDF'
@@ -80,18 +85,18 @@ class Sampler(object):
             metaname = 'percentOfKSpace'
             samplingname = 'UniformMask_step'+str(self.stepsize)+'_rodir'+str(self.ROdir)
         elif self.undersamplingType == 3: #CenterMaskPercent
-            data = createCenterMaskPercent(slice, self.percentOfKSpace)
+            data, bounds = createCenterMaskPercent(slice, self.percentOfKSpace, returnBounds=True)
             samplingname = 'CenterMaskPercent_percent'+str(self.percentOfKSpace)
         elif self.undersamplingType == 4: #CenterMaskIgnoreLines
-            data = createCenterMaskIgnoreLines(slice, self.lines2ignore, returnMeta)
+            data, bounds = self._splitBounds(createCenterMaskIgnoreLines(slice, self.lines2ignore, returnMeta, returnBounds=True))
             metaname = 'percentOfKSpace'
             samplingname = 'CenterMaskIgnoreLines_lines2ignore'+str(self.lines2ignore)
         elif self.undersamplingType == 5: #CenterRatioMask
-            data = createCenterRatioMask(slice, self.percentOfKSpace, returnMeta)
+            data, bounds = self._splitBounds(createCenterRatioMask(slice, self.percentOfKSpace, returnMeta, returnBounds=True))
             metaname = 'NumOfLinesRemoved'
             samplingname = 'CenterRatioMask_percent'+str(self.percentOfKSpace)
         elif self.undersamplingType == 6: #CenterSquareMask
-            data = createCenterSquareMask(slice, self.percentOfKSpace, returnMeta)
+            data, bounds = self._splitBounds(createCenterSquareMask(slice, self.percentOfKSpace, returnMeta, returnBounds=True))
             metaname = 'NumOfLinesRemoved'
             samplingname = 'CenterSquareMask_percent'+str(self.percentOfKSpace)
         elif self.undersamplingType == 7: #High-frequency Mask
@@ -109,16 +114,17 @@ class Sampler(object):
                 fullspokes = baseresolution * self.fullresSpokesMulFactor
                 noOfSpokes = round(fullspokes * self.percentOfKSpace)
                 samplingname = 'GoldenAngle_dynspokes'+str(noOfSpokes)+'_percent'+str(self.percentOfKSpace)+'_fulResMulFact'+str(self.fullresSpokesMulFactor)
-                omtuple, dcftuple = createGASampling(slice, noOfSpokes, self.fullresSpokesMulFactor, returnFullOM=True, returnInvOM=True)
+                omtuple, dcftuple = createGASampling(slice, noOfSpokes, self.fullresSpokesMulFactor, returnFullOM=self.returnFullInvOM, returnInvOM=self.returnFullInvOM, iterativeDCF=self.iterativeDCF, dcfIterations=self.dcfIterations)
             else:
                 samplingname = 'GoldenAngle_spokes'+str(self.noOfSpokes)+'_fulResMulFact'+str(self.fullresSpokesMulFactor)
-                omtuple, dcftuple = createGASampling(slice, self.noOfSpokes, self.fullresSpokesMulFactor, returnFullOM=True, returnInvOM=True)
+                omtuple, dcftuple = createGASampling(slice, self.noOfSpokes, self.fullresSpokesMulFactor, returnFullOM=self.returnFullInvOM, returnInvOM=self.returnFullInvOM, iterativeDCF=self.iterativeDCF, dcfIterations=self.dcfIterations)
             data['om'] = omtuple[0]
-            data['fullom'] = omtuple[1]
-            data['invom'] = omtuple[2]
             data['dcf'] = dcftuple[0]
-            data['dcfFullRes'] = dcftuple[1]
-            data['dcfInvRes'] = dcftuple[2]
+            if self.returnFullInvOM:
+                data['fullom'] = omtuple[1]
+                data['invom'] = omtuple[2]
+                data['dcfFullRes'] = dcftuple[1]
+                data['dcfInvRes'] = dcftuple[2]
         elif self.undersamplingType == 11: #Equi-distance
             print('TODO')
         
@@ -126,9 +132,17 @@ class Sampler(object):
             samplings = data
         else:
             if returnMeta and self.undersamplingType not in self.MasksWOMetaReturn:
-                samplings = {'mask': data[0], metaname: data[1]}
+                samplings = {'mask': Mask(data[0], bounds), metaname: data[1]}
             else:
-                samplings = {'mask': data}
+                samplings = {'mask': Mask(data, bounds)}
+            samplings['acceleration'] = 1 / max(samplings['mask'].fraction, 1 / samplings['mask'].size) #realised acceleration factor
+            if bounds is not None:
+                samplings['bounds'] = bounds #bounds of the kept rectangle of the center masks ((start_dim1, stop_dim1), (start_dim2, stop_dim2))
         samplings['samplingname'] = samplingname
 
-        return samplings
\ No newline at end of file
+        return samplings
+
+    @staticmethod
+    def _splitBounds(data):
+        #Separates the bounds (always the last one returned) from the mask and the meta (if returned)
+        return (data[:-1] if len(data) > 2 else data[0]), data[-1]
\ No newline at end of file
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the centered 2D Fourier transforms (fft2c followed by ifft2c, as in the Cartesian undersampling)
+Compares the batched transforms of utils.FrequencyTransforms (complex128 and complex64) against the previous per-slice loop,
+reporting the time and the peak memory (tracemalloc) of each. Usage (from the root of the repository):-
+python benchmarks/FFT2cBenchmark.py [batchSizeBytes]
+
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils.FrequencyTransforms as FrequencyTransforms
+from utils.FrequencyTransforms import fft2c, ifft2c
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+def _loop2c(func, x):
+    #The previous implementation: one slice (and coil) at a time, always in complex128
+    f = np.empty(x.shape, dtype=np.complex128)
+    for idx in np.ndindex(*x.shape[2:]):
+        sl = (slice(None), slice(None)) + idx
+        f[sl] = np.fft.fftshift(func(np.fft.ifftshift(x[sl])))
+    return f
+
+def _measure(func, x):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(x)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main(shapes=((256,256,150), (256,256,40,8))):
+    variants = [
+        ('loop', lambda x: _loop2c(np.fft.ifft2, _loop2c(np.fft.fft2, x))),
+        ('complex128', lambda x: ifft2c(fft2c(x))),
+        ('complex64', lambda x: ifft2c(fft2c(x, dtype=np.complex64), dtype=np.complex64)),
+    ]
+    print('batchSizeBytes: ' + str(FrequencyTransforms.batchSizeBytes))
+    for shape in shapes:
+        x = np.random.default_rng(0).random(shape)
+        reference = None
+        for name, func in variants:
+            result, elapsed, peak = _measure(func, x)
+            if reference is None:
+                reference = result
+            print('%s %s: %.2fs, peak %.0f MB, max diff to loop %.1e' % (shape, name, elapsed, peak / 2**20, abs(result - reference).max()))
+            del result
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        FrequencyTransforms.batchSizeBytes = int(sys.argv[1])
+    main()
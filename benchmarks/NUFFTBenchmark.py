@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""
+Benchmark of the NUFFT engines of the radial undersampling (RadialUndersampling.Perform), on a golden-angle trajectory (createGASampling)
+Compares the built-in Kaiser-Bessel NUFFT (kb, complex64 and complex128) against pynufft, reporting the time to plan, the time to undersample the volume,
+the size of the interpolation matrices, and the relative (max) error of the forward NUFFT, the adjoint NUFFT and the undersampled volume against pynufft.
+Usage (from the root of the repository):-
+python benchmarks/NUFFTBenchmark.py [noOfSpokes]
+
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from RadialUndersampling.GoldenAngle import createGASampling
+from RadialUndersampling.NUFFTPlans import getPlan, clearPlanCache
+from RadialUndersampling.Perform import performUndersampling, getGrids
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+def _relativeError(result, reference):
+    return np.abs(result - reference).max() / np.abs(reference).max()
+
+def main(shape=(128,128,50), noOfSpokes=60, interpolationSize4NUFFT=6):
+    variants = [('pynufft', np.complex64), ('kb', np.complex64), ('kb', np.complex128)]
+    rng = np.random.default_rng(0)
+    fullImgVol = rng.random(shape)
+    omtuple, dcftuple = createGASampling(fullImgVol[..., 0], noOfSpokes, returnFullOM=False, returnInvOM=False)
+    om, dcf = omtuple[0], dcftuple[0]
+    Nd, Kd, Jd, _ = getGrids(shape[:2], interpolationSize4NUFFT=interpolationSize4NUFFT)
+    image = fullImgVol[..., 0] + 1j*rng.random(shape[:2])
+    ksp = rng.random(len(om)) + 1j*rng.random(len(om))
+    print('%s, %d spokes (%d points), Nd=%s Kd=%s Jd=%s' % (shape, noOfSpokes, len(om), Nd, Kd, Jd))
+
+    reference = None
+    for engine, dtype in variants:
+        clearPlanCache()
+        start = time.perf_counter()
+        NufftObj = getPlan(om, Nd, Kd, Jd, engine, dtype)
+        planTime = time.perf_counter() - start
+        start = time.perf_counter()
+        underImgVol = performUndersampling(fullImgVol, om, dcf, interpolationSize4NUFFT, nufftEngine=engine, nufftDtype=dtype)
+        runTime = time.perf_counter() - start
+        interpolatorMB = sum(a.nbytes for a in (NufftObj.sp.data, NufftObj.sp.indices, NufftObj.sp.indptr)) / 2**20
+        results = (NufftObj.forward(image), NufftObj.adjoint(ksp), underImgVol)
+        if reference is None:
+            reference = results
+        errors = [_relativeError(r, ref) for r, ref in zip(results, reference)]
+        print('%s %s: plan %.2fs (sp %.0f MB), undersampling %.2fs, error to pynufft: forward %.1e, adjoint %.1e, undersampled %.1e' % 
+              (engine, np.dtype(dtype).name, planTime, interpolatorMB, runTime, *errors))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(noOfSpokes=int(sys.argv[1]))
+    else:
+        main()
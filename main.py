@@ -7,10 +7,10 @@ All parameters have to be configured here
 
 import glob
 import os
+import tempfile
 from pathlib import Path
 
 import numpy as np
-import pydicom
 import scipy.io as sio
 import torchio as tio
 from scipy.signal import resample
@@ -18,11 +18,14 @@ from tqdm import tqdm
 from skimage.transform import resize
 
 from CartesianUndersampling.Perform import performUndersampling as cartUnder
-from RadialUndersampling.Perform import performUndersampling as radUnder
+from CartesianUndersampling.Mask import Mask
+from RadialUndersampling.Perform import performUndersampling as radUnder, performUndersamplingKSP as radUnderKSP, reportTradeoff, toeplitzPadFactor
+from RadialUndersampling.NUFFTPlans import setPlanCache
 from Sampler import Sampler
-from utils.Coils import generateBirdcageCSM
-from utils.HandleDicom import ListRead
-from utils.HandleNifti import FileRead, FileSave
+from utils.Coils import generateBirdcageCSM, compressCSM, combineRSS, combineCSM
+from utils.FFTBackends import setBackend
+from utils.HandleDicom import ListRead, SeriesScan
+from utils.HandleNifti import FileRead, FileSave, FileShape, SlabRead
 
 __author__ = "Soumick Chatterjee"
 __copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -37,15 +40,28 @@ __status__ = "Finished"
 useExistingMATs = False # [True/False] If an existing MAT file containing the sampling pattern (mask or om) is to be used.
 fullySampledPath = r'/run/media/soumick/Enterprise/Datasets/IXI/ISO_Resampled2T2/T1' #Root path containing fully sampled images (NIFTIs: .img, .nii, .nii.gz or DICOMs: .ima, .dcm)
 min_scan_no = None # Will be only used for DICOMs. If a single folder contains DICOMs from multiple scans, then using this parameter the starting scan number can be mentioned. If set to None, then will start from the very beginning.
+dicomIndexPath = r'' #Will be only used for DICOMs. SQLite file to keep the series information of the DICOMs in (keyed by path, mtime and size), so that the next runs only read the headers of new or changed files. Set it to r'' to read all of them each time
+dicomScanWorkers = 8 #[arbitrary] Will be only used for DICOMs. Number of threads reading the DICOMs (the headers for grouping them into series, and then each series)
 max_scan_no = None #Will be only used for DICOMs. Similar to the last one, itdenotes the last scan that to be considered. If set to None, then scans will be considered till the very last.
 underSampledOutPath = r'/run/media/soumick/Enterprise/Datasets/IXI/ISO_Resampled2T2/BiLinear256/Under/T1' #Root path to store the undersampled output
 outFolder = r'CentreSquare6p25Mask' #Inside the underSampledOutPath, this folder will be created. Inside which the undersampled results will be stored
 zeropadOutput = True #By default set to True, when set to False doesn't zero pad the k-Space and decreases the pixel resolution of the output image. This should only be set True when using Cartesian CenterMasks
+niftiSlabSize = 32 #[arbitrary] Will be only used for NIFTIs (3D ones, without coil simulation and sliceZPadFourier). Volumes are read (memory-mapped, or decompressed slab by slab for .nii.gz), processed and written this many slices at a time, so that only one slab is in the memory at once. Set it to 0 to read whole volumes
+niftiSlabDtype = None #Data type of the slabs (e.g. np.float32). None keeps the data type of the file, same as reading whole volumes
 keepOriginalFormat = True # [True/False] Will be only used for NIFTIs. Specifies whether to keep the original NIFTI extension (e.g. .img) or different file extension to be used while saving
 saveFileFormat = '.nii.gz' # File extension to be used while saving the undersampled soutput. For NIFTIs, if keepOriginalFormat=True, then this will be ignored.
 nCoilElements = 0 # set it to zero if coil profile not needed
 
 NormWithABS = True #If False then Real will be used, if true then ABS
+fftBackend = 'scipy' #['numpy'/'scipy'/'pyfftw'] Backend to be used for all the FFTs. scipy and pyfftw (if installed) are multi-threaded
+fftWorkers = -1 #[arbitrary] Number of threads to be used by scipy and pyfftw backends. -1 will use all the cores
+fftWisdomPath = r'' #Will be only used by pyfftw backend. File to load the FFTW plans (wisdom) from and to save them to, so that the planning is done only once across runs
+nufftEngine = 'pynufft' #['pynufft'/'kb'] NUFFT engine to be used by the radial undersampling. 'kb' is the built-in Kaiser-Bessel gridding NUFFT
+nufftDtype = np.complex64 #[np.complex64/np.complex128] Precision of the NUFFT. Will be only used by the 'kb' engine, pynufft always uses np.complex64
+radialToeplitz = True #[True/False] If True, radial undersampling uses the Toeplitz operator (its kernel computed once for each trajectory) instead of performing the NUFFTs for each slice. Same result, up to the NUFFT approximation error
+nufftPlanCacheSize = 4 #[arbitrary] Number of NUFFT plans (one for each trajectory and grid) to be kept in memory by the radial undersampling
+nufftPlanCacheDir = r'' #Folder to store the NUFFT plans to, so that any other process (or run) with the same trajectory doesn't plan again. Set it to r'' to only keep them in memory
+cartesianDtype = np.complex128 #[np.complex128/np.complex64] Precision of the Cartesian undersampling. np.complex64 keeps the whole Cartesian path in single precision, using half of the memory
 
 #Params for using MATs - will be ignored if useExistingMATs is False
 isRadial = False
@@ -55,6 +71,11 @@ mask_or_om_path = r""
 #Params for coil simulation
 relative_radius = 0.8 #for birdcage simulation
 simulate4each = True #This is needed when they have different height and width. If true, then inputShape varible will be used which is mentioned below
+coilChunkMemory = 2**30 #[bytes] Memory budget for the coil simulation. The coils are simulated and undersampled a chunk at a time (as many coils as fit in this budget) and written chunk by chunk, instead of creating the whole coil volume first. Set it to 0 to create the whole coil volume first
+coilCompressionEnergy = 0 #[between 0 and 1] If set, the coils are compressed (SVD/PCA) to the fewest virtual coils keeping this fraction of the energy, and the virtual coils are simulated, saved and undersampled instead. Set it to 0 to keep all the coils
+coilCompression4Each = False #[True/False] Will be only used if coilCompressionEnergy is set. If True, the compression is computed for each volume (weighted by its image), otherwise once for the coil sensitivities
+coilCombination = None #[None/'rss'/'csm'] If set, the undersampled coil images are combined (root-sum-of-squares, or sensitivity-weighted with the simulated coil sensitivities) and the combined volume is saved in underSampledOutPath
+underSampledCoilOutPath = None #Will be only used if coilCombination is set. Root path to also store the undersampled coil volumes (the outFolder is created inside it too). If set to None, only the combined volumes are saved
 fullySampledCoilImgOutPath = r''#None# r'' #It will only be used when nCoilElements > 0 and this variable is not None. When you don't want to save the fully sampled coil images, then set it to None 
 
 #Params for generating fresh sampling patterns - will be ignored if useExistingMATs is True
@@ -75,7 +96,14 @@ maxAmplitude4PDF = 0.5 #[between 0 and 1] compression factor of distribution. To
 ROdir = 0 #[0, 1, 2 (both-direction)] Read-out direction. To be used by Varden masks, uniform and high-frequency mask (Cartesian samplings : 0, 2, 7)
 noOfSpokes = 60 #[arbitrary] Number of spokes to sample. To be used by Radial samplings
 fullresSpokesMulFactor = 2 #[arbitrary] Helps to define full resolution during radial sampling (GA), as in theory it can in infinite. Siemens recomands 2 or 3. 
-interpolationSize4NUFFT = 6 #To be used by Radial Samplings
+interpolationSize4NUFFT = 8 #To be used by Radial Samplings. Lower oversamplingRatio4NUFFT needs wider interpolation for the same accuracy
+padFactor4NUFFT = 1 #[>=1] Zero-padding factor of the image for the NUFFT. Doesn't change the result, only the cost (previously it was always 2). To be used by Radial Samplings
+oversamplingRatio4NUFFT = 1.5 #[>1] k-Space grid oversampling ratio of the NUFFT (previously it was always 2, on the 2x padded image). To be used by Radial Samplings
+radialOutput = 'image' #['image'/'ksp'/'both'] Output of Radial Samplings. 'ksp' saves the sampled radial k-Space (np.complex64, M x slices [x coils]) as .ksp.npy (written batch by batch) with its trajectory (om, dcf) as .ksp.om.mat, without computing the undersampled image. 'both' saves both
+reportRadialTradeoff = True #[True/False] If True, the accuracy and the memory of the NUFFT with the above parameters are reported once at the beginning (for the 2x padded grid of the Toeplitz operator, if radialToeplitz). To be used by Radial Samplings
+iterativeDCF = False #[True/False] If True, the DCF is computed iteratively (Pipe & Menon) for the trajectory, accounting for the non-uniform golden angle spokes, instead of the analytic ramp. Computed once for each trajectory (cached also in nufftPlanCacheDir, if set). To be used by Radial Samplings
+dcfIterations = 10 #[arbitrary] Number of iterations for the iterative DCF (two sparse matrix-vector products each)
+saveFullInvOM = False #[True/False] If the full resolution and the inverse trajectories (fullom, invom) and their DCFs are also to be created and saved in the MAT files. To be used by Radial Samplings
 sliceUndersamplingFactor = 1 #[arbitrary] For Undersampling in the slice direction, this factor can be used. Setting this to 1 will make it inactive. Setting this more than 1 will choose every Nth slice. 
 sliceZPadFourier = False
 safeSliceUndersampling = True
@@ -84,10 +112,14 @@ safeSliceUndersampling = True
 ######Params configuration zone ends here
 
 underSampledOutPath = os.path.join(underSampledOutPath, outFolder)
+if underSampledCoilOutPath:
+    underSampledCoilOutPath = os.path.join(underSampledCoilOutPath, outFolder)
+setBackend(fftBackend, fftWorkers, fftWisdomPath)
+setPlanCache(nufftPlanCacheSize, nufftPlanCacheDir)
 
 if useExistingMATs:
     if(not isRadial):
-        mask = sio.loadmat(mask_or_om_path)['mask']
+        mask = Mask(sio.loadmat(mask_or_om_path)['mask'])
     else:
         temp_mat =  sio.loadmat(mask_or_om_path)
         om = temp_mat['om']
@@ -96,7 +128,7 @@ else:
     if recalculateUndersampling4Each:
         inputShape = None
 
-    sampler = Sampler(undersamplingType, percentOfKSpace, centrePercent, stepsize, lines2ignore, maxAmplitude4PDF, ROdir, noOfSpokes, fullresSpokesMulFactor, interpolationSize4NUFFT, inputShape)
+    sampler = Sampler(undersamplingType, percentOfKSpace, centrePercent, stepsize, lines2ignore, maxAmplitude4PDF, ROdir, noOfSpokes, fullresSpokesMulFactor, interpolationSize4NUFFT, inputShape, saveFullInvOM, iterativeDCF, dcfIterations)
     isRadial = sampler.isRadial
 
     if not recalculateUndersampling4Each:
@@ -108,13 +140,20 @@ else:
             dcf = samplings['dcf'].squeeze()
         sio.savemat(staticSamplingFileName, samplings)
 
+if isRadial and reportRadialTradeoff and inputShape is not None:
+    #For the grid which is actually used for the undersampled images (its plan is then reused, not planned only for the report)
+    reportPadFactor = toeplitzPadFactor if radialToeplitz and radialOutput != 'ksp' else padFactor4NUFFT
+    reportTradeoff(om, inputShape, interpolationSize4NUFFT, reportPadFactor, oversamplingRatio4NUFFT, nufftEngine, nufftDtype)
 
 if not simulate4each :
     csm = generateBirdcageCSM(inputShape, nCoilElements, relative_radius)
+    if coilCompressionEnergy and not coilCompression4Each:
+        csm, _ = compressCSM(csm, coilCompressionEnergy)
 else:
     csm = None
+_compressedCSMs = {} #When simulate4each, the coil sensitivities are compressed once for each shape (unless coilCompression4Each)
 
-def _croppad_interpolate(fullImgVol, inplane_size, fullpath_file_fully=None):
+def _croporpadOrInterpolate(fullImgVol, inplane_size):
     if len(fullImgVol.shape) == 3 and len(inplane_size) == 2:
         inplane_size += (fullImgVol.shape[-1],)
     if croporpad:
@@ -122,9 +161,20 @@ def _croppad_interpolate(fullImgVol, inplane_size, fullpath_file_fully=None):
         fullImgVol = cop(np.expand_dims(fullImgVol,axis=0))[0]
     elif interpolate:
         fullImgVol = resize(fullImgVol, inplane_size)
-    if bool(fullySampledCropPaddedPath) and fullpath_file_fully is not None:
-        fullpath_file_cop = fullpath_file_fully.replace(fullySampledPath, fullySampledCropPaddedPath)
-        os.makedirs(os.path.dirname(fullpath_file_cop), exist_ok=True)
+    return fullImgVol
+
+def _cropPaddedPath(fullpath_file_fully):
+    #Where the cropped/padded (or interpolated) fully sampled volume is to be saved, None if not to be saved
+    if not bool(fullySampledCropPaddedPath) or fullpath_file_fully is None:
+        return None
+    fullpath_file_cop = fullpath_file_fully.replace(fullySampledPath, fullySampledCropPaddedPath)
+    os.makedirs(os.path.dirname(fullpath_file_cop), exist_ok=True)
+    return fullpath_file_cop
+
+def _croppad_interpolate(fullImgVol, inplane_size, fullpath_file_fully=None):
+    fullImgVol = _croporpadOrInterpolate(fullImgVol, inplane_size)
+    fullpath_file_cop = _cropPaddedPath(fullpath_file_fully)
+    if fullpath_file_cop is not None:
         if ".npy" in fullpath_file_cop:
             with open(fullpath_file_cop, 'wb') as f:
                 np.save(f, fullImgVol)
@@ -132,14 +182,31 @@ def _croppad_interpolate(fullImgVol, inplane_size, fullpath_file_fully=None):
             FileSave(fullImgVol, fullpath_file_cop)
     return fullImgVol
     
-def _getCoilImages(fullImgVol, csm, fullpath_file_fully=None):
-    if csm is None:
-        csm = generateBirdcageCSM(fullImgVol.shape[0:2], nCoilElements, relative_radius)
-    coilVolComplex = np.zeros(fullImgVol.shape+(nCoilElements,), dtype=np.complex64)
+def _coilImages(fullImgVol, csm):
+    #Images of the coils in csm (coils x height x width), as np.complex64 with the coils as the last dim
+    coilVolComplex = np.zeros(fullImgVol.shape+(csm.shape[0],), dtype=np.complex64)
     for i in range(fullImgVol.shape[-1]):
         img = fullImgVol[...,i]
         img = img[np.newaxis, :, :] * csm
         coilVolComplex[...,i,:] = img.transpose((1,2,0))
+    return coilVolComplex
+
+def _getCSM(fullImgVol, csm):
+    #Coil sensitivities for the volume, compressed to virtual coils if coilCompressionEnergy is set
+    if csm is None:
+        csm = generateBirdcageCSM(fullImgVol.shape[0:2], nCoilElements, relative_radius)
+        if coilCompressionEnergy and not coilCompression4Each:
+            if csm.shape not in _compressedCSMs:
+                _compressedCSMs[csm.shape], _ = compressCSM(csm, coilCompressionEnergy)
+            csm = _compressedCSMs[csm.shape]
+    if coilCompressionEnergy and coilCompression4Each:
+        weights = np.sum(abs(fullImgVol)**2, axis=tuple(range(2, len(fullImgVol.shape))))
+        csm, _ = compressCSM(csm, coilCompressionEnergy, weights=weights)
+    return csm
+
+def _getCoilImages(fullImgVol, csm, fullpath_file_fully=None):
+    csm = _getCSM(fullImgVol, csm)
+    coilVolComplex = _coilImages(fullImgVol, csm)
     if fullySampledCoilImgOutPath is not None and fullpath_file_fully is not None:
         fullpath_file_fullycoil = fullpath_file_fully.replace(fullySampledPath, fullySampledCoilImgOutPath)
         os.makedirs(os.path.dirname(fullpath_file_fullycoil), exist_ok=True)
@@ -153,55 +220,224 @@ def _getCoilImages(fullImgVol, csm, fullpath_file_fully=None):
                 np.save(f, coilVol)
         else:
             FileSave(coilVol, fullpath_file_fullycoil)
-    return coilVolComplex
+    return coilVolComplex, csm
+
+def _undersampleRadial(fullImgVol, fullpath_file_under, kspVol=None, part=slice(None)):
+    #Saves the sampled radial k-Space if radialOutput is 'ksp' or 'both', returns the undersampled image (None if radialOutput is 'ksp')
+    #kspVol, part: the k-Space file (already opened) and which part of its last dim fullImgVol holds, when the coils (or the slices of 3D volumes) are undersampled a chunk at a time
+    kspOut = None
+    if radialOutput in ('ksp', 'both'):
+        keptImgVol = fullImgVol[:,:,::sliceUndersamplingFactor,...]
+        if kspVol is None:
+            kspVol = _openRadialKSP(fullImgVol.shape, fullpath_file_under)
+        kspChunk = kspVol if part == slice(None) else np.zeros((om.shape[0],) + keptImgVol.shape[2:], dtype=np.complex64) #the part of kspVol is not contiguous
+        if radialOutput == 'ksp' or sliceUndersamplingFactor != 1:
+            radUnderKSP(keptImgVol, om, interpolationSize4NUFFT, nufftEngine=nufftEngine, nufftDtype=nufftDtype, padFactor=padFactor4NUFFT, oversamplingRatio=oversamplingRatio4NUFFT, out=kspChunk)
+        else:
+            kspOut = kspChunk #written while undersampling, sharing the forward NUFFT
+    underImgVol = None
+    if radialOutput != 'ksp':
+        underImgVol = radUnder(fullImgVol, om, dcf, interpolationSize4NUFFT, nufftEngine=nufftEngine, nufftDtype=nufftDtype, toeplitz=radialToeplitz, padFactor=padFactor4NUFFT, oversamplingRatio=oversamplingRatio4NUFFT, kspOut=kspOut)
+    if kspVol is not None:
+        if kspChunk is not kspVol:
+            kspVol[..., part] = kspChunk
+        kspVol.flush()
+    return underImgVol
+
+def _openRadialKSP(imageShape, fullpath_file_under):
+    #.ksp.npy (M x slices [x coils], written batch by batch) and its trajectory as .ksp.om.mat
+    nSlices = len(range(imageShape[2])[::sliceUndersamplingFactor])
+    kspVol = np.lib.format.open_memmap(fullpath_file_under + '.ksp.npy', mode='w+', dtype=np.complex64, shape=(om.shape[0], nSlices) + tuple(imageShape[3:]))
+    sio.savemat(fullpath_file_under + '.ksp.om.mat', {'om': om, 'dcf': dcf, 'imageShape': imageShape[:2]})
+    return kspVol
+
+def _recalculateSamplings(slice, fullpath_file_under):
+    if(not isRadial):
+        global mask
+    else:
+        global om, dcf
+    samplings = sampler.calculateSamplings(slice=slice, returnMeta=True)
+    if(not isRadial):
+        mask = samplings['mask'] 
+        samplingfilename = fullpath_file_under + '.mask.mat'
+    else:
+        om = samplings['om'] 
+        dcf = samplings['dcf'].squeeze() 
+        samplingfilename = fullpath_file_under + '.om.mat'
+    sio.savemat(samplingfilename, samplings)
+
+def _undersampleVol(fullImgVol, fullpath_file_under, kspVol=None, part=slice(None)):
+    if len(fullImgVol.shape) == 4 and not isRadial:
+        underImgVol = np.zeros(fullImgVol.shape, dtype=fullImgVol.dtype)
+        for i in range(fullImgVol.shape[3]):
+            coilImgFull = fullImgVol[:,:,:,i] 
+            coilImgUnder = cartUnder(coilImgFull, mask, zeropad=zeropadOutput, dtype=cartesianDtype)
+            if i == 0 and coilImgUnder.shape != fullImgVol.shape[:3]: #Without zeropad
+                underImgVol = np.zeros(coilImgUnder.shape + fullImgVol.shape[3:], dtype=fullImgVol.dtype)
+            underImgVol[:,:,:,i] = coilImgUnder 
+    elif(not isRadial):
+        underImgVol = cartUnder(fullImgVol, mask, zeropad=zeropadOutput, dtype=cartesianDtype)
+    else:
+        underImgVol = _undersampleRadial(fullImgVol, fullpath_file_under, kspVol, part) #All slices and coils are undersampled together, in batches
+    return underImgVol
 
-def _undersample(fullImgVol, fullpath_file_under):
-    try:
-        if(not isRadial):
-            global mask
+def _postprocess(underImgVol, isComplex, nSlices):
+    if not isComplex:
+        if NormWithABS:
+            underImgVol = abs(underImgVol)
         else:
-            global om, dcf, interpolationSize4NUFFT
-        if recalculateUndersampling4Each:
-            samplings = sampler.calculateSamplings(slice=fullImgVol[...,0], returnMeta=True)
-            if(not isRadial):
-                mask = samplings['mask'] 
-                underImgVol = cartUnder(fullImgVol, mask, zeropad=zeropadOutput)
-                samplingfilename = fullpath_file_under + '.mask.mat'
-            else:
-                om = samplings['om'] 
-                dcf = samplings['dcf'].squeeze() 
-                underImgVol = radUnder(fullImgVol, om, dcf)
-                samplingfilename = fullpath_file_under + '.om.mat'
-            sio.savemat(samplingfilename, samplings)
+            underImgVol = underImgVol.real
+    underImgVol = underImgVol[:,:,::sliceUndersamplingFactor,...]
+    if sliceZPadFourier:
+        underImgVol = resample(x=underImgVol, num=nSlices, axis=2)
+    return underImgVol
+
+def _save(vol, fullpath_file):
+    if ".npy" in fullpath_file:
+        if isinstance(vol, np.memmap): #Already written chunk by chunk
+            vol.flush()
         else:
-            if len(fullImgVol.shape) == 4:
-                underImgVol = np.zeros(fullImgVol.shape, dtype=fullImgVol.dtype)
-                for i in range(fullImgVol.shape[3]):
-                    coilImgFull = fullImgVol[:,:,:,i] 
-                    if(not isRadial):
-                        coilImgUnder = cartUnder(coilImgFull, mask, zeropad=zeropadOutput)
-                    else:
-                        coilImgUnder = radUnder(coilImgFull, om, dcf, interpolationSize4NUFFT)
-                    underImgVol[:,:,:,i] = coilImgUnder 
-            else:
-                if(not isRadial):
-                    underImgVol = cartUnder(fullImgVol, mask, zeropad=zeropadOutput)
-                else:
-                    underImgVol = radUnder(fullImgVol, om, dcf, interpolationSize4NUFFT)
-        if not np.iscomplexobj(fullImgVol):
-            if NormWithABS:
-                underImgVol = abs(underImgVol)
+            with open(fullpath_file, 'wb') as f:
+                np.save(f, vol)
+    else:
+        FileSave(vol, fullpath_file)
+
+def _undersampledCoilPath(fullpath_file_under):
+    #Where the undersampled coil volume is to be saved, None if only the combined volume is to be saved
+    if not coilCombination:
+        return fullpath_file_under
+    if not underSampledCoilOutPath:
+        return None
+    fullpath_file_undercoil = fullpath_file_under.replace(underSampledOutPath, underSampledCoilOutPath)
+    os.makedirs(os.path.dirname(fullpath_file_undercoil), exist_ok=True)
+    return fullpath_file_undercoil
+
+def _undersample(fullImgVol, fullpath_file_under, csm=None):
+    #csm: coil sensitivities of the coil volume (coils as the last dim of fullImgVol), to combine the undersampled coil images if coilCombination is set
+    try:
+        if recalculateUndersampling4Each:
+            _recalculateSamplings(fullImgVol[...,0], fullpath_file_under)
+        underImgVol = _undersampleVol(fullImgVol, fullpath_file_under)
+        if underImgVol is None: #Only the radial k-Space was to be saved
+            return
+        underImgVol = _postprocess(underImgVol, np.iscomplexobj(fullImgVol), fullImgVol.shape[2])
+        if coilCombination and csm is not None:
+            fullpath_file_undercoil = _undersampledCoilPath(fullpath_file_under)
+            if fullpath_file_undercoil is not None:
+                _save(underImgVol, fullpath_file_undercoil)
+            underImgVol = combineRSS(underImgVol) if coilCombination == 'rss' else combineCSM(underImgVol, csm)
+        _save(underImgVol, fullpath_file_under)
+    except Exception as ex:
+        print(ex)
+
+def _openOutput(fullpath_file, shape, dtype):
+    #Output written chunk by chunk: directly to the file for .npy, otherwise to a temporary file next to it (deleted once saved), so that it's never completely in the memory
+    if ".npy" in fullpath_file:
+        return np.lib.format.open_memmap(fullpath_file, mode='w+', dtype=dtype, shape=shape)
+    return np.memmap(tempfile.TemporaryFile(dir=os.path.dirname(fullpath_file)), mode='w+', dtype=dtype, shape=shape)
+
+def _outputChunk(chunk, fullpath_file):
+    #Complex volumes are kept as np.complex64 in .npy, otherwise their magnitudes are saved (as FileSave does)
+    if np.iscomplexobj(chunk):
+        return chunk.astype(np.complex64, copy=False) if ".npy" in fullpath_file else abs(chunk).astype(np.float32, copy=False)
+    return chunk
+
+def _undersampleCoils(fullImgVol, csm, fullpath_file_fully, fullpath_file_under):
+    #Simulates the coil images and undersamples them a chunk of coils at a time (as many as fit in coilChunkMemory), instead of creating the whole coil volume first.
+    #Same outputs as _getCoilImages followed by _undersample, but the peak memory scales with the chunk size and not with nCoilElements
+    try:
+        csm = _getCSM(fullImgVol, csm)
+        nCoils = csm.shape[0] #Virtual coils, if compressed
+        if recalculateUndersampling4Each:
+            _recalculateSamplings(fullImgVol[...,0], fullpath_file_under)
+        #For each coil: its images (np.complex64), the working copies of the undersampling (two, in cartesianDtype) and its output
+        bytesPerCoil = np.prod(fullImgVol.shape) * (2*np.dtype(np.complex64).itemsize + 2*np.dtype(cartesianDtype).itemsize)
+        coilsPerChunk = int(max(1, coilChunkMemory // bytesPerCoil))
+        saveCoilImgs = fullySampledCoilImgOutPath is not None and fullpath_file_fully is not None
+        if saveCoilImgs:
+            fullpath_file_fullycoil = fullpath_file_fully.replace(fullySampledPath, fullySampledCoilImgOutPath)
+            os.makedirs(os.path.dirname(fullpath_file_fullycoil), exist_ok=True)
+        kspVol = _openRadialKSP(fullImgVol.shape + (nCoils,), fullpath_file_under) if isRadial and radialOutput in ('ksp', 'both') else None
+        fullpath_file_undercoil = _undersampledCoilPath(fullpath_file_under)
+        coilVol = None
+        underImgVol = None
+        combined = None
+        for start in range(0, nCoils, coilsPerChunk):
+            coils = slice(start, min(start + coilsPerChunk, nCoils))
+            coilChunk = _coilImages(fullImgVol, csm[coils])
+            if saveCoilImgs:
+                coilImgChunk = coilChunk
+                if not np.iscomplexobj(fullImgVol):
+                    coilImgChunk = abs(coilChunk) if NormWithABS else coilChunk.real
+                coilImgChunk = _outputChunk(coilImgChunk, fullpath_file_fullycoil)
+                if coilVol is None:
+                    coilVol = _openOutput(fullpath_file_fullycoil, coilChunk.shape[:-1] + (nCoils,), coilImgChunk.dtype)
+                coilVol[..., coils] = coilImgChunk
+
+            underChunk = _undersampleVol(coilChunk, fullpath_file_under, kspVol, coils)
+            del coilChunk
+            if underChunk is None: #Only the radial k-Space was to be saved
+                continue
+            underChunk = _postprocess(underChunk, True, fullImgVol.shape[2])
+            if coilCombination: #Added up chunk by chunk
+                combinedChunk = np.sum(abs(underChunk)**2, -1) if coilCombination == 'rss' else combineCSM(underChunk, csm[coils], normalize=False)
+                combined = combinedChunk if combined is None else combined + combinedChunk
+            if fullpath_file_undercoil is None:
+                continue
+            underChunk = _outputChunk(underChunk, fullpath_file_undercoil)
+            if underImgVol is None:
+                underImgVol = _openOutput(fullpath_file_undercoil, underChunk.shape[:-1] + (nCoils,), underChunk.dtype)
+            underImgVol[..., coils] = underChunk
+
+        if coilVol is not None:
+            _save(coilVol, fullpath_file_fullycoil)
+        if underImgVol is not None:
+            _save(underImgVol, fullpath_file_undercoil)
+        if combined is not None:
+            if coilCombination == 'rss':
+                combined = np.sqrt(combined)
             else:
-                underImgVol = underImgVol.real
-        underImgVol = underImgVol[:,:,::sliceUndersamplingFactor,...]
-        if sliceZPadFourier:
-            underImgVol = resample(x=underImgVol, num=fullImgVol.shape[2], axis=2)
-                        
-        if ".npy" in fullpath_file_under:
-            with open(fullpath_file_under, 'wb') as f:
-                np.save(f, underImgVol)
-        else:
-            FileSave(underImgVol, fullpath_file_under)
+                combined /= np.sum(abs(csm)**2, 0).reshape(csm.shape[1:] + (1,)*(combined.ndim-2))
+            _save(combined, fullpath_file_under)
+    except Exception as ex:
+        print(ex)
+
+def _undersampleSlabs(fullpath_file_fully, fullpath_file_under, nSlices):
+    #Reads (see SlabRead), crops/pads or interpolates, undersamples and writes a NIFTI volume niftiSlabSize slices at a time, so that only a slab of it is in the memory at once
+    #For 3D volumes without coil simulation and sliceZPadFourier (the slices are processed independently otherwise)
+    try:
+        slabSize = -(-niftiSlabSize // sliceUndersamplingFactor) * sliceUndersamplingFactor #So that each slab starts with a kept slice
+        fullpath_file_cop = _cropPaddedPath(fullpath_file_fully) if croporpad or interpolate else None
+        copVol = None
+        underImgVol = None
+        kspVol = None
+        for start, slab in SlabRead(fullpath_file_fully, slabSize, niftiSlabDtype):
+            if croporpad or interpolate:
+                slab = _croporpadOrInterpolate(slab, inputShape)
+                if fullpath_file_cop is not None:
+                    if copVol is None:
+                        copVol = _openOutput(fullpath_file_cop, slab.shape[:2] + (nSlices,), slab.dtype)
+                    copVol[:, :, start:start+slab.shape[2]] = slab
+            if start == 0:
+                if recalculateUndersampling4Each:
+                    _recalculateSamplings(slab[...,0], fullpath_file_under)
+                if isRadial and radialOutput in ('ksp', 'both'):
+                    kspVol = _openRadialKSP(slab.shape[:2] + (nSlices,), fullpath_file_under)
+            kept = slice(start // sliceUndersamplingFactor, start // sliceUndersamplingFactor + len(range(slab.shape[2])[::sliceUndersamplingFactor]))
+            underSlab = _undersampleVol(slab, fullpath_file_under, kspVol, kept)
+            if underSlab is None: #Only the radial k-Space was to be saved
+                continue
+            underSlab = _postprocess(underSlab, np.iscomplexobj(slab), slab.shape[2])
+            if np.iscomplexobj(underSlab) and ".npy" not in fullpath_file_under: #FileSave saves the magnitude
+                underSlab = abs(underSlab)
+            if underImgVol is None:
+                underImgVol = _openOutput(fullpath_file_under, underSlab.shape[:2] + (len(range(nSlices)[::sliceUndersamplingFactor]),), underSlab.dtype)
+            underImgVol[:, :, kept] = underSlab
+        
+        if copVol is not None:
+            _save(copVol, fullpath_file_cop)
+        if underImgVol is not None:
+            _save(underImgVol, fullpath_file_under)
     except Exception as ex:
         print(ex)
 
@@ -225,9 +461,13 @@ for fullpath_file_fully in tqdm(files):
     # if not keepOriginalFormat: #It has to be the original format. Npy has no alternatives.
     #     filename, _ = os.path.splitext(fullpath_file_under)
     #     fullpath_file_under = filename + saveFileFormat
+    if nCoilElements != 0 and coilChunkMemory:
+        _undersampleCoils(fullImgVol, csm, fullpath_file_fully, fullpath_file_under)
+        continue
+    volCSM = None
     if nCoilElements != 0:
-        fullImgVol = _getCoilImages(fullImgVol, csm, fullpath_file_fully)
-    _undersample(fullImgVol, fullpath_file_under)
+        fullImgVol, volCSM = _getCoilImages(fullImgVol, csm, fullpath_file_fully)
+    _undersample(fullImgVol, fullpath_file_under, volCSM)
 
 #Deal with NIFTI
 types = ('.img', '.nii', '.nii.gz') # the tuple of file types
@@ -237,6 +477,19 @@ for type in types:
 #files = glob.glob(fullySampledPath+'/**/*.img', recursive=True)
 
 for fullpath_file_fully in tqdm(files):
+    niiShape = FileShape(fullpath_file_fully)
+    if niftiSlabSize and nCoilElements == 0 and not sliceZPadFourier and len(niiShape) >= 3 and 1 not in niiShape[:3] and all(n == 1 for n in niiShape[3:]):
+        if safeSliceUndersampling and niiShape[2] % sliceUndersamplingFactor != 0:
+            print("Skipping as nSlice not divisable by slice undersampling factor")
+            continue
+        fullpath_file_under = fullpath_file_fully.replace(fullySampledPath, underSampledOutPath)
+        os.makedirs(os.path.dirname(fullpath_file_under), exist_ok=True) #create directorries if doesnt exist
+        if not keepOriginalFormat:
+            filename, _ = os.path.splitext(fullpath_file_under)
+            fullpath_file_under = filename + saveFileFormat
+        _undersampleSlabs(fullpath_file_fully, fullpath_file_under, niiShape[2])
+        continue
+
     fullImgVol = FileRead(fullpath_file_fully).squeeze() #Squeeze to remove channel dim if only one channel
     fullImgVol = _croppad_interpolate(fullImgVol, inputShape, fullpath_file_fully) if croporpad or interpolate else fullImgVol
     if safeSliceUndersampling and fullImgVol.shape[-1] % sliceUndersamplingFactor != 0:
@@ -248,9 +501,13 @@ for fullpath_file_fully in tqdm(files):
     if not keepOriginalFormat:
         filename, _ = os.path.splitext(fullpath_file_under)
         fullpath_file_under = filename + saveFileFormat
+    if nCoilElements != 0 and coilChunkMemory:
+        _undersampleCoils(fullImgVol, csm, fullpath_file_fully, fullpath_file_under)
+        continue
+    volCSM = None
     if nCoilElements != 0:
-        fullImgVol = _getCoilImages(fullImgVol, csm, fullpath_file_fully)
-    _undersample(fullImgVol, fullpath_file_under)
+        fullImgVol, volCSM = _getCoilImages(fullImgVol, csm, fullpath_file_fully)
+    _undersample(fullImgVol, fullpath_file_under, volCSM)
 
 
 #Deal with DICOMs
@@ -260,22 +517,24 @@ for type in types:
     files.extend(glob.glob(fullySampledPath+'/**/*'+type, recursive=True))
 
 dicoms = {}
+headers = SeriesScan(files, dicomIndexPath, dicomScanWorkers) #Only the tags needed for grouping
 for file in tqdm(files):
     #file_name = Path(file).stem
-    dicom = pydicom.dcmread(file)
-    scan_no = int(dicom.SeriesNumber)
+    scan_no, protocol_name, series_date, series_time = headers[file]
+    if scan_no is None:
+        continue
     if (((max_scan_no is None) and (min_scan_no is not None) and (scan_no < min_scan_no))
        or ((max_scan_no is not None) and (min_scan_no is not None) and ((scan_no < min_scan_no) or (scan_no > max_scan_no)))
           or ((max_scan_no is not None) and (min_scan_no is None) and (scan_no > max_scan_no))):
         continue
-    dicom_identifier = str(scan_no) + '.' + dicom.ProtocolName + '.' +  str(dicom.SeriesDate) + '.' + str(dicom.SeriesTime)
+    dicom_identifier = str(scan_no) + '.' + protocol_name + '.' +  series_date + '.' + series_time
     if dicom_identifier in dicoms:
         dicoms[dicom_identifier].append(file)
     else:
         dicoms[dicom_identifier] = [file]
 
 for identifier, files in tqdm(dicoms.items()):
-    fullImgVol = ListRead(files).squeeze() #Squeeze to remove channel dim if only one channel
+    fullImgVol = ListRead(files, n_workers=dicomScanWorkers).squeeze() #Squeeze to remove channel dim if only one channel
     fullImgVol = _croppad_interpolate(fullImgVol, inputShape, fullpath_file_fully) if croporpad or interpolate else fullImgVol
     if safeSliceUndersampling and fullImgVol.shape[-1] % sliceUndersamplingFactor != 0:
         print("Skipping as nSlice not divisable by slice undersampling factor")
@@ -286,6 +545,10 @@ for identifier, files in tqdm(dicoms.items()):
     os.makedirs(os.path.dirname(fullpath_file_under), exist_ok=True) #create directorries if doesnt exist
 
     fullImgVol = _croppad_interpolate(fullImgVol, inputShape, fullpath_file_fully) if croporpad or interpolate else fullImgVol
+    if nCoilElements != 0 and coilChunkMemory:
+        _undersampleCoils(fullImgVol, csm, fullpath_file_fully, fullpath_file_under)
+        continue
+    volCSM = None
     if nCoilElements != 0:
-        fullImgVol = _getCoilImages(fullImgVol, csm, fullpath_file_fully)
-    _undersample(fullImgVol, fullpath_file_under)
+        fullImgVol, volCSM = _getCoilImages(fullImgVol, csm, fullpath_file_fully)
+    _undersample(fullImgVol, fullpath_file_under, volCSM)
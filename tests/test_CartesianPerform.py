@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+"""
+Regression checks for the Cartesian undersampling (CartesianUndersampling.Perform)
+
+"""
+
+import numpy as np
+from CartesianUndersampling.Perform import performUndersamplingKSP
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+def _reference(fullKSPVol, mask):
+    return np.where(np.asarray(mask)[..., np.newaxis], fullKSPVol, 0)
+
+def test_KSPMemoryLayouts():
+    #Non C-contiguous k-Space (Fortran-ordered, as from NIFTIs, or transposed views, as from DICOMs) has to give the same result
+    rng = np.random.default_rng(0)
+    fullKSPVol = rng.standard_normal((16,16,4)) + 1j*rng.standard_normal((16,16,4))
+    masks = [rng.random((16,16)) < 0.3, #random points
+             np.repeat(rng.random((16,1)) < 0.5, 16, axis=1), #lines
+             np.repeat(rng.random((1,16)) < 0.5, 16, axis=0)]
+    for mask in masks:
+        expected = _reference(fullKSPVol, mask)
+        for ksp in (fullKSPVol, np.asfortranarray(fullKSPVol), fullKSPVol.transpose(1,0,2).copy().transpose(1,0,2)):
+            underKSPVol = performUndersamplingKSP(ksp, mask)
+            assert np.array_equal(underKSPVol, expected)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""
+Regression checks for the Fourier transforms (utils.FrequencyTransforms)
+
+"""
+
+import numpy as np
+import pytest
+from utils.FrequencyTransforms import fft2c, ifft2c, fftNc, ifftNc, fhtNc, filterNc
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+def test_NcDefaultAxesWithShape():
+    #As numpy, without axes the last len(shape) axes are transformed
+    x = np.random.default_rng(0).random((4,6,3))
+    expected = np.fft.fftshift(np.fft.fftn(np.fft.ifftshift(x), s=(8,8), axes=(1,2)))
+    assert np.allclose(fftNc(x, shape=(8,8)), expected)
+    expected = np.fft.fftshift(np.fft.ifftn(np.fft.ifftshift(x), s=(8,8), axes=(1,2)))
+    assert np.allclose(ifftNc(x, shape=(8,8)), expected)
+    assert fhtNc(x, shape=(8,8)).shape == (4,8,8)
+
+def test_NcKeepIdxSeveralAxes():
+    #Index arrays along more than one axis keep their outer product, as cropping the full result one axis at a time
+    x = np.random.default_rng(0).random((3,3,2))
+    rows, cols = np.array([0,2]), np.array([1,2,0])
+    for func in (fftNc, ifftNc):
+        full = func(x, axes=(0,1), shiftAxes=(0,1))
+        expected = full[rows][:,cols]
+        assert np.allclose(func(x, axes=(0,1), shiftAxes=(0,1), keepIdx=(rows, cols)), expected)
+        expected = full[rows][:,1:3]
+        assert np.allclose(func(x, axes=(0,1), shiftAxes=(0,1), keepIdx=(rows, slice(1,3))), expected)
+
+@pytest.mark.parametrize('shape', [(16,12,5), (15,9,4), (8,10,3,2), (7,8,3,2)])
+@pytest.mark.parametrize('dtype', [np.complex64, np.complex128])
+def test_ShiftFreeMatchesShifts(shape, dtype):
+    #The checkerboard modulation (shiftFree, filterNc) is equal to the fftshift and ifftshift path, odd sizes fall back to the shifts
+    rng = np.random.default_rng(0)
+    x = rng.random(shape) + 1j*rng.random(shape)
+    mask = rng.random(shape[:2]) > 0.5
+    tol = dict(rtol=1e-5, atol=1e-5) if dtype == np.complex64 else dict(rtol=1e-12, atol=1e-12)
+    for func in (fft2c, ifft2c, fftNc, ifftNc):
+        kwargs = dict(dtype=dtype) if func in (fft2c, ifft2c) else dict(axes=(0,1), shiftAxes=(0,1), dtype=dtype)
+        expected = func(x, shiftFree=False, **kwargs)
+        result = func(x, shiftFree=True, **kwargs)
+        assert result.dtype == expected.dtype == dtype
+        assert np.allclose(result, expected, **tol)
+    expected = ifft2c(mask.reshape(shape[:2] + (1,)*(len(shape)-2)) * fft2c(x, dtype=dtype), dtype=dtype)
+    result = filterNc(x, mask, dtype=dtype)
+    assert result.dtype == dtype
+    assert np.allclose(result, expected, **tol)
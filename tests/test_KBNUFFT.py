@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+"""
+Checks of the built-in Kaiser-Bessel NUFFT (RadialUndersampling.KBNUFFT) against pynufft, on a golden-angle trajectory
+
+"""
+
+import numpy as np
+import pytest
+from RadialUndersampling.GoldenAngle import createGASampling
+from RadialUndersampling.NUFFTPlans import getPlan
+from RadialUndersampling.Perform import getGrids
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+@pytest.mark.parametrize('dtype', [np.complex64, np.complex128])
+def test_KBNUFFTMatchesPynufft(dtype):
+    pytest.importorskip('pynufft')
+    rng = np.random.default_rng(0)
+    image = rng.random((32,32)) + 1j*rng.random((32,32))
+    omtuple, _ = createGASampling(image, 20, returnFullOM=False, returnInvOM=False)
+    om = omtuple[0]
+    ksp = rng.random(len(om)) + 1j*rng.random(len(om))
+    Nd, Kd, Jd, _ = getGrids(image.shape)
+    kb = getPlan(om, Nd, Kd, Jd, 'kb', dtype)
+    reference = getPlan(om, Nd, Kd, Jd, 'pynufft')
+
+    expected = reference.forward(image)
+    assert np.abs(kb.forward(image) - expected).max() / np.abs(expected).max() < 1e-4
+    expected = reference.adjoint(ksp)
+    result = kb.adjoint(ksp)
+    assert result.dtype == dtype
+    assert np.abs(result - expected).max() / np.abs(expected).max() < 1e-4
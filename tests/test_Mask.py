@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+"""
+Regression checks for the Mask type (CartesianUndersampling.Mask)
+
+"""
+
+import copy
+import numpy as np
+import pytest
+from CartesianUndersampling.Mask import Mask
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+def test_CachedViewsDontGoStale():
+    mask = Mask(np.eye(4, dtype=bool), bounds=((0,4),(0,4)))
+    mask.rows
+    #Copies are read-only, with the bounds but without the cache
+    for masked in (mask.copy(), copy.copy(mask), copy.deepcopy(mask)):
+        assert isinstance(masked, Mask) and masked.bounds == mask.bounds
+        with pytest.raises(ValueError):
+            masked[0,0] = False
+    #A writable Mask is not cached
+    masked = np.zeros_like(mask)
+    assert len(masked.rows) == 0
+    masked[1,1] = True
+    assert list(masked.rows) == [1] and masked.fraction == 1/16
@@ -3,8 +3,11 @@
 """
 This module contains utils realted to coil - such as coil simulation, coil combination etc.
 For now, only generation of bird card coil sensitivies been added. Other profiles to be added in future.
+The birdcage sensitivities are computed for all the pixels at once (complex64), and the last few are cached (LRU) for each set of parameters,
+so volumes with the same shape reuse them. The cached maps are read-only.
 """
 
+import functools
 import numpy as np
 
 __author__ = "Soumick Chatterjee"
@@ -23,33 +26,105 @@ def generateBirdcageCSM(matrix_size = 256, number_of_coils = 8, relative_radius
     :param matrix_size: size of imaging matrix in pixels (default ``256``)
     :param number_of_coils: Number of simulated coils (default ``8``)
     :param relative_radius: Relative radius of birdcage (default ``1.5``)
+    :param normalize: Normalize the sensitivities by their root-sum-of-squares (default ``True``)
+    :returns: read-only complex64 array (number_of_coils x matrix_size), cached for the same parameters
 
     This function is from ismrmrd-python-tools, which is heavily inspired by the mri_birdcage.m Matlab script in
     Jeff Fessler's IRT package: http://web.eecs.umich.edu/~fessler/code/
 
     """
 
-    if type(matrix_size) is not tuple:
+    if np.isscalar(matrix_size):
         matrix_size = (matrix_size,matrix_size)
 
+    return _generateBirdcageCSM(tuple(int(n) for n in matrix_size), int(number_of_coils), float(relative_radius), bool(normalize))
+
+@functools.lru_cache(maxsize=8)
+def _generateBirdcageCSM(matrix_size, number_of_coils, relative_radius, normalize):
+    #Cached for each (matrix_size, number_of_coils, relative_radius, normalize), so the maps are returned read-only
     out = np.zeros((number_of_coils,)+matrix_size,dtype=np.complex64)
 
+    y_grid = ((np.arange(matrix_size[0])-matrix_size[0]/2)/(matrix_size[0]/2))[:,np.newaxis]
+    x_grid = ((np.arange(matrix_size[1])-matrix_size[1]/2)/(matrix_size[1]/2))[np.newaxis,:]
     for c in range(0,number_of_coils):
         coilx = relative_radius*np.cos(c*(2*np.pi/number_of_coils))
         coily = relative_radius*np.sin(c*(2*np.pi/number_of_coils))
         coil_phase = -c*(2*np.pi/number_of_coils)
 
-        for y in range(0,matrix_size[0]):
-            y_co = float(y-matrix_size[0]/2)/float(matrix_size[0]/2)-coily
-
-            for x in range(0,matrix_size[1]):
-                x_co = float(x-matrix_size[1]/2)/float(matrix_size[1]/2)-coilx
-                rr = np.sqrt(x_co**2+y_co**2)
-                phi = np.arctan2(x_co, -y_co) + coil_phase
-                out[c,y,x] =  (1/rr) * np.exp(1j*phi)
+        #All the pixels at once
+        y_co = y_grid-coily
+        x_co = x_grid-coilx
+        rr = np.sqrt(x_co**2+y_co**2)
+        phi = np.arctan2(x_co, -y_co) + coil_phase
+        out[c] = (1/rr) * np.exp(1j*phi)
                 
     if normalize:
-         rss = np.squeeze(np.sqrt(np.sum(abs(out) ** 2, 0)))
-         out = out / np.tile(rss,(number_of_coils,1,1))
+         rss = np.sqrt(np.sum(abs(out) ** 2, 0))
+         out /= rss
          
+    out.flags.writeable = False
     return out
+
+def compressCSM(csm, energy = 0.99, number_of_virtual_coils = None, weights = None):
+
+    """ Coil compression (SVD/PCA) of the coil sensitivities, to fewer virtual coils.
+
+    :param csm: coil sensitivities (number_of_coils x matrix_size)
+    :param energy: fraction of the energy the virtual coils have to keep (default ``0.99``). Ignored if number_of_virtual_coils is given
+    :param number_of_virtual_coils: number of virtual coils to be kept (default ``None``, as many as energy needs)
+    :param weights: energy of the image at each pixel (matrix_size), to compress for one volume. Uniform if ``None``
+    :returns: virtual coil sensitivities (number_of_virtual_coils x matrix_size, complex64) and the compression matrix (number_of_virtual_coils x number_of_coils)
+
+    As the coil images are the image multiplied by the sensitivities, compressing the sensitivities once
+    is the same as compressing the coil images of each volume (with the same weights), and the virtual coil images are then simulated directly.
+
+    """
+
+    coils = csm.reshape(csm.shape[0], -1)
+    valid = np.isfinite(coils).all(0) #Pixels at the coils themselves are not finite
+    weighted = coils[:, valid].astype(np.complex128)
+    if weights is not None:
+        weighted *= np.sqrt(np.asarray(weights, dtype=np.float64).ravel()[valid])
+    
+    #Eigen decomposition of the coil covariance (number_of_coils x number_of_coils) instead of the SVD of the whole data
+    eigvals, eigvecs = np.linalg.eigh(weighted @ weighted.conj().T)
+    eigvals, eigvecs = np.maximum(eigvals[::-1], 0), eigvecs[:, ::-1]
+    if number_of_virtual_coils is None:
+        cumulative = np.cumsum(eigvals) / eigvals.sum()
+        number_of_virtual_coils = int(np.searchsorted(cumulative, energy)) + 1
+    number_of_virtual_coils = min(number_of_virtual_coils, csm.shape[0])
+
+    compression = eigvecs[:, :number_of_virtual_coils].conj().T
+    virtual_csm = (compression @ coils).reshape((number_of_virtual_coils,) + csm.shape[1:]).astype(np.complex64)
+    return virtual_csm, compression
+
+def combineRSS(coil_images):
+
+    """ Root-sum-of-squares combination of the coil images.
+
+    :param coil_images: coil images (matrix_size x ... x number_of_coils)
+    :returns: combined image (matrix_size x ...)
+
+    """
+
+    return np.sqrt(np.sum(abs(coil_images)**2, -1))
+
+def combineCSM(coil_images, csm, normalize = True):
+
+    """ Sensitivity-weighted (adjoint) combination of the coil images: sum of conj(csm) x coil image, divided by sum of abs(csm)**2.
+
+    :param coil_images: coil images (matrix_size x ... x number_of_coils)
+    :param csm: coil sensitivities of them (number_of_coils x matrix_size)
+    :param normalize: divide by the sum of abs(csm)**2 (default ``True``). ``False`` to combine chunks of coils, to be added up and divided only once at the end
+    :returns: combined image (matrix_size x ...)
+
+    Real coil images (e.g. magnitudes) are weighted with abs(csm), which gives the magnitude of the image the same way.
+
+    """
+
+    assert coil_images.shape[:2] == csm.shape[1:] and coil_images.shape[-1] == csm.shape[0], 'Coil images and sensitivities have to be of the same size (matrix_size and number_of_coils)'
+    weights = np.conj(csm) if np.iscomplexobj(coil_images) else abs(csm)
+    combined = np.einsum('ij...c,cij->ij...', coil_images, weights)
+    if normalize:
+        combined /= np.sum(abs(csm)**2, 0).reshape(csm.shape[1:] + (1,)*(combined.ndim-2))
+    return combined
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""
+This module provides a registry of FFT backends. All the transforms of FrequencyTransforms are dispatched through the active backend.
+
+Available backends:-
+    numpy : numpy.fft (default), single-threaded
+    scipy : scipy.fft, multi-threaded using workers
+    pyfftw : pyfftw.interfaces.scipy_fft (only if pyFFTW is installed), multi-threaded using workers. 
+             The plans (wisdom) can be saved to and reloaded from disk between runs, using wisdomPath
+
+Usage:-
+    setBackend('scipy', workers=-1) #-1: use all the cores
+    setBackend('pyfftw', workers=32, wisdomPath='fftw.wisdom')
+
+New backends can be added using registerBackend, with a factory function accepting workers and wisdomPath, 
+returning an FFTBackend wrapping a module which follows the numpy.fft API (fft, ifft, fft2, ifft2, fftn, ifftn, rfft, irfft, etc.)
+
+"""
+
+import atexit
+import functools
+import os
+import pickle
+import numpy as np
+
+__author__ = "Soumick Chatterjee"
+__copyright__ = "Copyright 2019, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
+__credits__ = ["Soumick Chatterjee"]
+
+__license__ = "GPL"
+__version__ = "0.0.1"
+__email__ = "soumick.chatterjee@ovgu.de"
+__status__ = "Finished"
+
+class FFTBackend(object):
+    """Wraps a module following the numpy.fft API, 
+    passes the given keyword arguments (e.g. workers) to each of its transforms.
+    inplaceArg: how the module can write the output into the buffer of the input, 
+    'out' (numpy.fft), 'overwrite_x' (scipy.fft, pyFFTW) or None if it can't"""
+
+    def __init__(self, name, module, inplaceArg=None, **kwargs):
+        self.name = name
+        self.module = module
+        self.inplaceArg = inplaceArg
+        self.kwargs = kwargs
+
+    def __getattr__(self, funcname):
+        func = getattr(self.module, funcname)
+        if self.kwargs:
+            return functools.partial(func, **self.kwargs)
+        else:
+            return func
+
+    def inplace(self, funcname, x, **kwargs):
+        """Performs the transform funcname, reusing the buffer of x for the output if the module supports it (x is overwritten).
+        Only for the complex to complex transforms with the output of the same shape as x, and x of the output's dtype.
+        Returns the output, which might still be a new array (e.g. if x is not contiguous)"""
+        func = getattr(self, funcname)
+        if self.inplaceArg == 'out':
+            return func(x, out=x, **kwargs)
+        elif self.inplaceArg == 'overwrite_x':
+            return func(x, overwrite_x=True, **kwargs)
+        else:
+            return func(x, **kwargs)
+
+def _numpyBackend(workers=None, wisdomPath=None):
+    return FFTBackend('numpy', np.fft, inplaceArg='out')
+
+def _scipyBackend(workers=None, wisdomPath=None):
+    import scipy.fft
+    return FFTBackend('scipy', scipy.fft, inplaceArg='overwrite_x', workers=workers)
+
+_wisdomPaths = set() #Paths for which saveWisdom is already registered to run at exit
+
+def _pyfftwBackend(workers=None, wisdomPath=None):
+    try:
+        import pyfftw
+        import pyfftw.interfaces.scipy_fft as fftw
+    except ImportError:
+        raise ImportError('FFT backend pyfftw requires pyFFTW to be installed')
+    pyfftw.interfaces.cache.enable()
+    if workers is not None and workers < 0:
+        workers = os.cpu_count() + 1 + workers
+    if bool(wisdomPath):
+        loadWisdom(wisdomPath)
+        if os.path.abspath(wisdomPath) not in _wisdomPaths: #Saved only once at exit, however many times the backend is set
+            _wisdomPaths.add(os.path.abspath(wisdomPath))
+            atexit.register(saveWisdom, wisdomPath)
+    return FFTBackend('pyfftw', fftw, inplaceArg='overwrite_x', workers=workers)
+
+def loadWisdom(wisdomPath):
+    """Loads the pyFFTW wisdom (plans) from the given path, if it exists"""
+    import pyfftw
+    if os.path.isfile(wisdomPath):
+        with open(wisdomPath, 'rb') as f:
+            pyfftw.import_wisdom(pickle.load(f))
+
+def saveWisdom(wisdomPath):
+    """Saves the pyFFTW wisdom (plans) gathered so far to the given path"""
+    import pyfftw
+    with open(wisdomPath, 'wb') as f:
+        pickle.dump(pyfftw.export_wisdom(), f)
+
+_factories = {'numpy': _numpyBackend, 'scipy': _scipyBackend, 'pyfftw': _pyfftwBackend}
+_backend = _numpyBackend()
+
+def registerBackend(name, factory):
+    """Registers a new backend. factory(workers, wisdomPath) has to return an FFTBackend"""
+    _factories[name] = factory
+
+def availableBackends():
+    """Returns the names of the registered backends"""
+    return list(_factories.keys())
+
+def setBackend(name='numpy', workers=None, wisdomPath=None):
+    """Sets the backend to be used by all the transforms. 
+    workers: number of threads (negative values count back from the number of cores), ignored by numpy
+    wisdomPath: file to load the plans from and to save them to at exit, only used by pyfftw"""
+    global _backend
+    assert name in _factories, 'Unrecognized FFT backend '+str(name)
+    _backend = _factories[name](workers=workers, wisdomPath=wisdomPath)
+    return _backend
+
+def getBackend():
+    """Returns the active backend"""
+    return _backend
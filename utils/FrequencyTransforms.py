@@ -4,6 +4,9 @@
 This model deals in transform to and from frequency domain.
 They are all been centered (fftshit) - because of our MRI applications
 
+All the transforms are dispatched through the active FFT backend (numpy.fft by default), see utils.FFTBackends.setBackend
+to use multi-threaded scipy.fft or pyFFTW instead.
+
 All the functions contain a optional parameter normalize. By default, it's none.
 The default normalization has the direct transforms unscaled and the inverse transforms are scaled by 1/n. 
 It is possible to obtain unitary transforms by setting the keyword argument norm to "ortho" (default is None) 
@@ -24,10 +27,20 @@ shiftAxes: int or tuple
 normalize: None or “ortho”
 norm_with_fnorm (only for hartley): bool
 use_real_fourier (only for hartley): bool
+dtype (only for fft2c, ifft2c, fftNc, ifftNc, filterNc and rfilterNc): numpy.complex64 or numpy.complex128
+shiftFree (only for fft2c, ifft2c, fftNc and ifftNc): bool
+batchSize (only for fft2c, ifft2c, fftNc, ifftNc, filterNc and rfilterNc): None (use batchSizeBytes) or int - maximum size (in bytes) of one batch
+
+For even-sized grids, the centered transform is equal to the uncentered transform with a ±1 checkerboard modulation 
+of the input and the output. shiftFree=True uses this (in place) instead of the fftshift and ifftshift copies. 
+It falls back to the shifts for odd-sized grids.
 
 """
 
+import functools
+import itertools
 import numpy as np   
+from utils.FFTBackends import getBackend
 
 __author__ = "Soumick Chatterjee"
 __copyright__ = "Copyright 2018, Soumick Chatterjee & OvGU:ESF:MEMoRIAL"
@@ -43,93 +56,241 @@ __status__ = "Finished, but more might be added later"
 
 #Standard Fourier Transform - 1D
 def fftc(x, fixedLen=None, axis=-1, shiftAxes = None, normalize=None):
-    f = np.fft.fftshift(np.fft.fft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
+    f = np.fft.fftshift(getBackend().fft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
     return f
 
-def ifftc(x, fixedLen=None, axis=-1, normalize=None):
-    f = np.fft.fftshift(np.fft.ifft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
+def ifftc(x, fixedLen=None, axis=-1, shiftAxes = None, normalize=None):
+    f = np.fft.fftshift(getBackend().ifft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
     return f   
 
 #Standard Fourier Transform - 2D
-#def fft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None): # originally was axes=(-2,-1), shiftAxes = None
-#    #f1 = np.fft.fft2(x, s=shape, axes=axes, norm=normalize) #Here is the problem. When we pass axes it gives NaN
-#    #f = np.fft.ifftshift(x, axes=shiftAxes)
-#    #f = np.fft.fft2(f, s=shape, axes=axes, norm=normalize)
-#    #f = np.fft.fftshift(f, axes=shiftAxes)
-#    f = np.fft.fftshift(np.fft.fft2(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
-#    return f
-# This version isn't working. Giving NaN for all elements. TODO: debug the problem
-
-def fft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None): # originally was axes=(-2,-1), shiftAxes = None
-    f = np.empty(x.shape,dtype=np.complex128)
-    if(len(x.shape) == 4):
-        for i in range(x.shape[-1]):
-            for j in range(x.shape[-2]):
-                f[:,:,j,i] = np.fft.fftshift(np.fft.fft2(np.fft.ifftshift(x[:,:,j,i]), s=shape, norm=normalize))
-    elif(len(x.shape) == 3):
-        for i in range(x.shape[-1]):
-            f[:,:,i] = np.fft.fftshift(np.fft.fft2(np.fft.ifftshift(x[:,:,i]), s=shape, norm=normalize))
-    else:
-        f = np.fft.fftshift(np.fft.fft2(np.fft.ifftshift(x), s=shape, norm=normalize))
-    return f
+#Transforms are batched over all the axes not mentioned in axes (e.g. slices and coils), so a whole volume is transformed in a few calls
+#dtype (complex64 or complex128) controls the precision of the output, complex64 halves the memory footprint
+#fftn and ifftn are used with the 2 axes, as numpy's ifft2 ignores out (so it can't be performed in place)
+def fft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None, dtype=np.complex128, shiftFree=False, batchSize=None): # originally was axes=(-2,-1), shiftAxes = None
+    return _batchedTransform('fftn', x, shape, axes, shiftAxes, normalize, dtype, shiftFree, batchSize=batchSize)
 
-#def ifft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None): # originally was axes=(-2,-1), shiftAxes = None
-#    f = np.fft.fftshift(np.fft.ifft2(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
-#    return f
-# Can't trust this version as similar fft2c isn't working
-
-def ifft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None): # originally was axes=(-2,-1), shiftAxes = None
-    f = np.empty(x.shape,dtype=np.complex128)
-    if(len(x.shape) == 4):
-        for i in range(x.shape[-1]):
-            for j in range(x.shape[-2]):
-                f[:,:,j,i] = np.fft.fftshift(np.fft.ifft2(np.fft.ifftshift(x[:,:,j,i]), s=shape, norm=normalize))
-    elif(len(x.shape) == 3):
-        for i in range(x.shape[-1]):
-            f[:,:,i] = np.fft.fftshift(np.fft.ifft2(np.fft.ifftshift(x[:,:,i]), s=shape, norm=normalize))
-    else:
-        f = np.fft.fftshift(np.fft.ifft2(np.fft.ifftshift(x), s=shape, norm=normalize))
-    return f
+def ifft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None, dtype=np.complex128, shiftFree=False, batchSize=None): # originally was axes=(-2,-1), shiftAxes = None
+    return _batchedTransform('ifftn', x, shape, axes, shiftAxes, normalize, dtype, shiftFree, batchSize=batchSize)
+
+def _defaultAxes(x, shape):
+    #As numpy: all the axes, or the last len(shape) axes if shape is given
+    return tuple(range(x.ndim)) if shape is None else tuple(range(x.ndim))[-len(shape):]
 
 #Standard Fourier Transform - nD
-def fftNc(x, shape=None, axes=None, shiftAxes = None, normalize=None):
-    f = np.fft.fftshift(np.fft.fftn(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
-    return f
+#keepIdx (optional): indices (slice or index array) to keep along each of the axes. The result is cropped while computing it (per batch),
+#so that the full-sized result is never allocated
+def fftNc(x, shape=None, axes=None, shiftAxes = None, normalize=None, dtype=np.complex128, shiftFree=False, keepIdx=None, batchSize=None):
+    axes = _defaultAxes(x, shape) if axes is None else axes
+    return _batchedTransform('fftn', x, shape, axes, shiftAxes, normalize, dtype, shiftFree, keepIdx, batchSize)
 
-def ifftNc(x, shape=None, axes=None, shiftAxes = None, normalize=None):
-    f = np.fft.fftshift(np.fft.ifftn(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
-    return f
+def ifftNc(x, shape=None, axes=None, shiftAxes = None, normalize=None, dtype=np.complex128, shiftFree=False, keepIdx=None, batchSize=None):
+    axes = _defaultAxes(x, shape) if axes is None else axes
+    return _batchedTransform('ifftn', x, shape, axes, shiftAxes, normalize, dtype, shiftFree, keepIdx, batchSize)
 
 ### Real Fourier Transform
 
 #Real Fourier Transform - 1D
 def rfftc(x, fixedLen=None, axis=-1, shiftAxes = None, normalize=None):
-    f = np.fft.fftshift(np.fft.rfft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
+    f = np.fft.fftshift(getBackend().rfft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
     return f
 
-def irfftc(x, fixedLen=None, axis=-1, normalize=None):
-    f = np.fft.fftshift(np.fft.irfft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
+def irfftc(x, fixedLen=None, axis=-1, shiftAxes = None, normalize=None):
+    f = np.fft.fftshift(getBackend().irfft(np.fft.ifftshift(x, axes=shiftAxes), n=fixedLen, axis=axis, norm=normalize), axes=shiftAxes)
     return f   
 
 #Real Fourier Transform - 2D
 def rfft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None): # originally was axes=(-2,-1), shiftAxes = None
-    f = np.fft.fftshift(np.fft.rfft2(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
+    f = np.fft.fftshift(getBackend().rfft2(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
     return f
 
 def irfft2c(x, shape=None, axes=(0,1), shiftAxes = (0,1), normalize=None): # originally was axes=(-2,-1), shiftAxes = None
-    f = np.fft.fftshift(np.fft.irfft2(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
+    f = np.fft.fftshift(getBackend().irfft2(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
     return f
 
 #Real Fourier Transform - nD
 def rfftNc(x, shape=None, axes=None, shiftAxes = None, normalize=None):
-    f = np.fft.fftshift(np.fft.rfftn(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
+    axes = _defaultAxes(x, shape) if axes is None else axes
+    f = np.fft.fftshift(getBackend().rfftn(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
     return f
 
 def irfftNc(x, shape=None, axes=None, shiftAxes = None, normalize=None):
-    f = np.fft.fftshift(np.fft.irfftn(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
+    axes = _defaultAxes(x, shape) if axes is None else axes
+    f = np.fft.fftshift(getBackend().irfftn(np.fft.ifftshift(x, axes=shiftAxes), s=shape, axes=axes, norm=normalize), axes=shiftAxes)
     return f
 
 
+#Generates the slicing tuples to split an array of the given shape into (at least) nBatch batches along batchAxes
+#The last batch axis is split into chunks first, the remaining batch axes are only iterated if more batches are needed
+def _batchSlices(shape, batchAxes, nBatch):
+    if len(batchAxes) == 0 or nBatch <= 1:
+        yield (Ellipsis,)
+        return
+    leadAxes, lastAxis = batchAxes[:-1], batchAxes[-1]
+    nLead = int(np.prod([shape[ax] for ax in leadAxes]))
+    if nBatch <= shape[lastAxis]:
+        leadAxes, nLead = [], 1
+    nChunks = min(shape[lastAxis], int(np.ceil(nBatch / nLead)))
+    for leadIdx in np.ndindex(*[shape[ax] for ax in leadAxes]):
+        for idx in np.array_split(np.arange(shape[lastAxis]), nChunks):
+            sl = [slice(None)] * len(shape)
+            for ax, i in zip(leadAxes, leadIdx):
+                sl[ax] = slice(i, i+1)
+            sl[lastAxis] = slice(idx[0], idx[-1]+1)
+            yield tuple(sl)
+
+#Default maximum size (in bytes) of the output of one batch of _batchedTransform and filterNc, can be overridden per call with batchSize
+#Each batch needs one temporary of this size (the casted and modulated or shifted input, which is then transformed in place)
+#Large enough for the backend's workers to parallelize over many slices per call (see benchmarks/FFT2cBenchmark.py)
+batchSizeBytes = 2**26
+
+#np.roll(src, shifts, axes) written directly into dst (casting to its dtype), without the intermediate copy of the shifted array
+#Used for ifftshift (shifts=-(n//2)) and fftshift (shifts=n//2)
+def _rollInto(dst, src, shifts, axes):
+    parts = [[(slice(None), slice(None))] for _ in range(src.ndim)]
+    for ax, shift in zip(axes, shifts):
+        n = src.shape[ax]
+        shift %= n
+        parts[ax] = [(slice(shift, None), slice(0, n-shift)), (slice(0, shift), slice(n-shift, None))]
+    for part in itertools.product(*parts):
+        dst[tuple(p[0] for p in part)] = src[tuple(p[1] for p in part)]
+    return dst
+
+#Keeps the indices idx (slice or index array) along each axis ax of crop, one axis at a time
+#(indexing with the index arrays of several axes together would pair them elementwise, instead of taking their outer product)
+def _crop(a, crop):
+    for ax, idx in crop:
+        a = a[(slice(None),)*ax + (idx,)]
+    return a
+
+def _shiftAxes(ndim, shiftAxes):
+    return tuple(range(ndim)) if shiftAxes is None else tuple(ax % ndim for ax in np.atleast_1d(shiftAxes))
+
+#Checkerboard (±1) modulation along the given axes, broadcastable to an array of ndim dimensions
+#fftshift(fft(ifftshift(x))) = sign * c * fft(c * x), for even-sized axes. sign is folded into the returned output modulation
+#Returns (input modulation, output modulation). They are cached, as the same shapes are used for all the volumes
+@functools.lru_cache(maxsize=32)
+def _checkerboard(ndim, axes, sizes, realDtype):
+    cIn = np.ones([1]*ndim, dtype=realDtype)
+    sign = 1
+    for ax, n in zip(axes, sizes):
+        c = np.ones(n, dtype=realDtype)
+        c[1::2] = -1
+        cIn = cIn * c.reshape([n if i == ax else 1 for i in range(ndim)])
+        sign *= (-1)**(n//2)
+    cOut = cIn * sign
+    cIn.flags.writeable = False
+    cOut.flags.writeable = False
+    return cIn, cOut
+
+#Whether the centered transform can be performed shift-free, using the checkerboard modulation
+#Only possible when the shifts are along the transformed axes, all of them have even sizes, and no padding or cropping (shape) is asked
+def _isShiftFree(xShape, shape, axes, shiftAxes):
+    ndim = len(xShape)
+    shifted = set(range(ndim)) if shiftAxes is None else {ax % ndim for ax in np.atleast_1d(shiftAxes)}
+    return (shifted == set(axes) and all(xShape[ax] % 2 == 0 for ax in axes) and 
+            (shape is None or tuple(shape) == tuple(xShape[ax] for ax in axes)))
+
+#Performs the centered transform funcname of the backend, in batches along the last axis which is not transformed or shifted
+#The input of each batch is casted to dtype while it's modulated or shifted (into one temporary), which is then transformed in place, 
+#and the output is modulated or shifted directly into the result
+def _batchedTransform(funcname, x, shape, axes, shiftAxes, normalize, dtype, shiftFree=False, keepIdx=None, batchSize=None):
+    axes = tuple(ax % x.ndim for ax in axes)
+    outShape = list(x.shape)
+    if shape is not None:
+        for ax, n in zip(axes, shape):
+            outShape[ax] = n
+    samePad = tuple(outShape) == x.shape #no padding or cropping by the transform itself, so it can be performed in place
+    nBatch = int(np.ceil(np.prod(outShape) * np.dtype(dtype).itemsize / (batchSize or batchSizeBytes))) #based on the size before cropping
+    crop = [] if keepIdx is None else list(zip(axes, keepIdx))
+    for ax, idx in crop:
+        outShape[ax] = len(range(outShape[ax])[idx]) if type(idx) is slice else len(idx)
+    f = np.empty(outShape, dtype=dtype)
+    realDtype = np.finfo(dtype).dtype
+    backend = getBackend()
+    shiftAxes = _shiftAxes(x.ndim, shiftAxes)
+
+    shiftFree = shiftFree and _isShiftFree(x.shape, shape, axes, shiftAxes)
+    if shiftFree:
+        cIn, cOut = _checkerboard(x.ndim, axes, tuple(x.shape[ax] for ax in axes), realDtype)
+        cOut = _crop(cOut, crop)
+
+    for sl in _batchSlices(x.shape, [ax for ax in range(x.ndim) if ax not in axes and ax not in shiftAxes], nBatch):
+        if shiftFree:
+            xb = np.multiply(x[sl], cIn, dtype=dtype)
+        else:
+            xb = _rollInto(np.empty(x[sl].shape, dtype=dtype), x[sl], [-(x.shape[ax]//2) for ax in shiftAxes], shiftAxes)
+        if samePad:
+            k = backend.inplace(funcname, xb, axes=axes, norm=normalize)
+        else:
+            k = getattr(backend, funcname)(xb, s=shape, axes=axes, norm=normalize)
+        del xb
+        if shiftFree:
+            np.multiply(_crop(k, crop), cOut, out=f[sl])
+        elif keepIdx is None:
+            _rollInto(f[sl], k, [k.shape[ax]//2 for ax in shiftAxes], shiftAxes)
+        else:
+            f[sl] = _crop(np.fft.fftshift(k, axes=shiftAxes), crop)
+        del k #before the temporary of the next batch is allocated
+    return f
+
+### Filtering in Fourier Space
+
+#Applies kspFilter (e.g. an undersampling mask) on the centered Fourier space of x along axes: ifftNc(kspFilter * fftNc(x))
+#kspFilter has the sizes of x along axes (in the same order as axes, which should be ascending) and is broadcasted over the remaining axes
+#The shifts are never performed on the data: for even-sized axes, both the checkerboard modulations cancel out in the Fourier space,
+#so only the input and the output are modulated. For odd-sized axes, the shifts are folded into the filter instead (only the filter is shifted).
+def filterNc(x, kspFilter, axes=(0,1), dtype=np.complex128, batchSize=None):
+    return _filterNc(x, kspFilter, axes, dtype, real=False, batchSize=batchSize)
+
+#Real version of filterNc. x has to be real and kspFilter has to be point-symmetric about the centre of the Fourier space (see isPointSymmetric),
+#then the result is also real. It is computed using rfftn and irfftn (half of the memory and compute), and returned as real (float32 for complex64)
+def rfilterNc(x, kspFilter, axes=(0,1), dtype=np.complex128, batchSize=None):
+    return _filterNc(x, kspFilter, axes, dtype, real=True, batchSize=batchSize)
+
+#Checks whether kspFilter is point-symmetric about the centre of the (centered) Fourier space, i.e. kspFilter[N//2+d] == kspFilter[N//2-d] (circularly)
+def isPointSymmetric(kspFilter, axes=None):
+    axes = tuple(range(kspFilter.ndim)) if axes is None else tuple(axes)
+    mirrored = np.roll(np.flip(kspFilter, axis=axes), shift=[1 - kspFilter.shape[ax] % 2 for ax in axes], axis=axes)
+    return np.array_equal(kspFilter, mirrored)
+
+def _filterNc(x, kspFilter, axes, dtype, real, batchSize=None):
+    axes = tuple(ax % x.ndim for ax in axes)
+    sizes = tuple(x.shape[ax] for ax in axes)
+    realDtype = np.finfo(dtype).dtype
+    backend = getBackend()
+    kspFilter = np.asarray(kspFilter).reshape([x.shape[i] if i in axes else 1 for i in range(x.ndim)])
+    f = np.empty(x.shape, dtype=realDtype if real else dtype)
+
+    shiftFree = all(n % 2 == 0 for n in sizes)
+    if shiftFree:
+        c, _ = _checkerboard(x.ndim, axes, sizes, realDtype) #sign cancels out for the forward-inverse pair
+    else:
+        kspFilter = np.fft.ifftshift(kspFilter, axes=axes)
+    if real: #Only the non-negative frequencies of the last axis are kept by rfftn
+        kspFilter = kspFilter[(slice(None),)*axes[-1] + (slice(0, sizes[-1]//2+1),)]
+        forward = functools.partial(backend.rfftn, axes=axes)
+        inverse = functools.partial(backend.irfftn, s=sizes, axes=axes)
+    else: #Both the transforms are performed in place, in the one temporary of the batch
+        forward = functools.partial(backend.inplace, 'fftn', axes=axes)
+        inverse = functools.partial(backend.inplace, 'ifftn', axes=axes)
+    kspFilter = kspFilter.astype(dtype if np.iscomplexobj(kspFilter) else realDtype, copy=False)
+    inDtype = realDtype if real else dtype
+
+    for sl in _batchSlices(x.shape, [ax for ax in range(x.ndim) if ax not in axes], int(np.ceil(f.nbytes / (batchSize or batchSizeBytes)))):
+        if shiftFree:
+            k = forward(np.multiply(x[sl], c, dtype=inDtype))
+        else:
+            k = forward(_rollInto(np.empty(x[sl].shape, dtype=inDtype), x[sl], [-(n//2) for n in sizes], axes))
+        k *= kspFilter
+        k = inverse(k)
+        if shiftFree:
+            np.multiply(k, c, out=f[sl])
+        else:
+            _rollInto(f[sl], k, [n//2 for n in sizes], axes)
+        del k #before the temporary of the next batch is allocated
+    return f
+
 ### Fourier Space to Magnitude and Phase 
 def f2mp(x):
     mag = np.abs(x)
@@ -184,7 +345,7 @@ def fhtNc(x, shape=None, axes=None, shiftAxes = None, norm_with_fnorm=False, use
     h = f.real - f.imag
     return h
 
-def ifhtNc(x, shape=None, axes=None, shiftAxes = None, norm_with_fnorm=False, normalize=None):
+def ifhtNc(x, shape=None, axes=None, shiftAxes = None, norm_with_fnorm=False, use_real_fourier=False, normalize=None):
     h = fhtNc(x, shape=shape, axes=axes, shiftAxes = shiftAxes, norm_with_fnorm=norm_with_fnorm, use_real_fourier=use_real_fourier, normalize=normalize) #Based on Hartley Transform algo x = H(H(x))
     return h 
 
@@ -4,11 +4,15 @@
 This module helps to handle DICOM files
 Can read individual files or even a complete folder, or a list of paths
 Also, helps the them to be converted to 2D or even 1D, and also back to 3D
+ListRead reads a series (sorted by slice position) in parallel into a preallocated array
+SeriesScan reads only the headers needed to group the files into series (in parallel), and can keep them in a SQLite index for the next runs
 
 """
 
 import os
+import sqlite3
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import filedialog
 import numpy as np
 import pydicom
@@ -61,21 +65,72 @@ def ChooseFolderNRead():
     folder_path = filedialog.askdirectory()
     return FolderRead(folder_path)
 
-def ListRead(file_list, expand_last_dim = False):
+def ListRead(file_list, expand_last_dim = False, n_workers = 8):
     """Read DICOM files (2D/3D), paths supplied as a list, as an array
+    Slices are sorted by their position (ImagePositionPatient along the slice direction), or by InstanceNumber if not all of them have it
+    The array is allocated once (shape and dtype from the first slice), and the pixel data are read into it in parallel by n_workers threads
     Using: PyDICOM"""
-    data = None
-    for file_path in file_list:
-        dcm = pydicom.dcmread(file_path)
-        if data is None:
-            data = dcm.pixel_array
-        else:
-            data = np.dstack((data, dcm.pixel_array))
-    data = data.transpose(data,[1,0,2])
+    with ThreadPoolExecutor(n_workers) as executor:
+        headers = list(executor.map(lambda file_path: pydicom.dcmread(file_path, stop_before_pixels=True), file_list))
+        file_list = [file_list[i] for i in _sliceOrder(headers)]
+
+        first = pydicom.dcmread(file_list[0]).pixel_array
+        frames = first.reshape((-1,) + first.shape[-2:]) #Slices in each file
+        data = np.empty((len(file_list) * frames.shape[0],) + frames.shape[1:], dtype=first.dtype)
+        data[:frames.shape[0]] = frames
+        def read(i):
+            data[i*frames.shape[0]:(i+1)*frames.shape[0]] = pydicom.dcmread(file_list[i]).pixel_array.reshape(frames.shape)
+        list(executor.map(read, range(1, len(file_list))))
+    data = data.transpose([2,1,0])
     if expand_last_dim: #If channel data not present
         data = np.expand_dims(data, -1)
     return data
 
+def _sliceOrder(headers):
+    if all('ImagePositionPatient' in dcm and 'ImageOrientationPatient' in dcm for dcm in headers):
+        keys = []
+        for dcm in headers:
+            orientation = np.array(dcm.ImageOrientationPatient, dtype=np.float64)
+            keys.append(np.dot(np.cross(orientation[:3], orientation[3:]), np.array(dcm.ImagePositionPatient, dtype=np.float64)))
+    elif all(dcm.get('InstanceNumber') is not None for dcm in headers):
+        keys = [int(dcm.InstanceNumber) for dcm in headers]
+    else: #As supplied
+        keys = range(len(headers))
+    return sorted(range(len(headers)), key=lambda i: keys[i])
+
+SeriesTags = ['SeriesNumber', 'ProtocolName', 'SeriesDate', 'SeriesTime']
+
+def SeriesScan(file_list, index_path=None, n_workers=8):
+    """Read SeriesNumber, ProtocolName, SeriesDate and SeriesTime of the DICOM files, returned as a dict of path: tuple of them (in that order)
+    Only those tags are read, not the rest of the header and the pixel data. Files are read in parallel by n_workers threads
+    If index_path is given, the tags are stored in that SQLite file, keyed by path, mtime and size, so that the next runs only read new or changed files
+    SeriesNumber is None if the file doesn't have it, the rest are '' if missing
+    Using: PyDICOM"""
+    index = {}
+    if index_path:
+        con = sqlite3.connect(index_path)
+        con.execute('CREATE TABLE IF NOT EXISTS series (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, SeriesNumber INTEGER, ProtocolName TEXT, SeriesDate TEXT, SeriesTime TEXT)')
+        index = {row[0]: row[1:] for row in con.execute('SELECT * FROM series')}
+
+    def scan(file_path):
+        stat = os.stat(file_path)
+        row = index.get(file_path)
+        if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return None
+        dcm = pydicom.dcmread(file_path, stop_before_pixels=True, specific_tags=SeriesTags)
+        series_no = int(dcm.SeriesNumber) if dcm.get('SeriesNumber') is not None else None
+        return (file_path, stat.st_mtime_ns, stat.st_size, series_no) + tuple(str(dcm.get(tag, '')) for tag in SeriesTags[1:])
+
+    with ThreadPoolExecutor(n_workers) as executor:
+        rows = [row for row in executor.map(scan, file_list) if row is not None]
+    if index_path:
+        with con:
+            con.executemany('INSERT OR REPLACE INTO series VALUES (?,?,?,?,?,?,?)', rows)
+        con.close()
+    for row in rows:
+        index[row[0]] = row[1:]
+    return {file_path: index[file_path][2:] for file_path in file_list}
+
 def FolderRead(folder_path):
     """Read DICOM files inside the given folder path, and read them as one 3D array
     Presuming the folder has only one DICOM series and its 3D
@@ -4,6 +4,7 @@
 This module helps to handle NIFTI files
 Can read individual files but not complete folder
 Also, helps the them to be converted to 2D or even 1D, and also back to 3D
+Files are read through the array proxy of NiBabel (memory-mapped for uncompressed files), and can also be read slab by slab (SlabRead)
 
 """
 
@@ -32,20 +33,39 @@ def ChooseFileNRead(Read3D=True):
     else:
         return FileRead2D(file_path)
 
-def FileRead(file_path, expand_last_dim=False):
+def FileRead(file_path, expand_last_dim=False, dtype=None):
     """Read a NIFTI file (3D) using given file path as an array
+    Uncompressed files (.nii, .img) without scaling are memory-mapped, so only the parts which are used are read
+    dtype: data type to convert the data to (default None keeps the data type of the file)
     Using: NiBabel"""
     nii = nib.load(file_path)
-    data = nii.get_data()
+    data = np.asanyarray(nii.dataobj)
+    if dtype is not None:
+        data = data.astype(dtype, copy=False)
     if expand_last_dim: #If channel data not present
         data = np.expand_dims(data, -1)
     return data
 
+def SlabRead(file_path, slab_size, dtype=None):
+    """Read a NIFTI file (3D) slab by slab, slab_size slices (of the 3rd dim) at a time, yielding the index of the first slice of each slab and the slab
+    Only the slab is read into the memory (for .nii.gz, the file is kept open and decompressed only once, up to each slab)
+    dtype: data type of the slabs (default None keeps the data type of the file)
+    Using: NiBabel"""
+    nii = nib.load(file_path, keep_file_open=True)
+    channels = (0,) * (len(nii.shape) - 3) #Only the first channel, if present
+    for start in range(0, nii.shape[2], slab_size):
+        yield start, np.asarray(nii.dataobj[(slice(None), slice(None), slice(start, start+slab_size)) + channels], dtype=dtype)
+
+def FileShape(file_path):
+    """Shape of a NIFTI file, reading only its header
+    Using: NiBabel"""
+    return nib.load(file_path).shape
+
 def FileRead3D(file_path):
     """Read a NIFTI file (3D) using given file path as an array
     Using: NiBabel"""
     nii = nib.load(file_path)
-    data = nii.get_data()
+    data = np.asanyarray(nii.dataobj)
     if (np.shape(np.shape(data))[0] == 3): #If channel data not present
         data = np.expand_dims(data, 3)
     return data
@@ -54,7 +74,7 @@ def FileRead2D(file_path):
     """Read a NIFTI file (2D) using given file path as an array
     Using: NiBabel"""
     nii = nib.load(file_path)
-    data = nii.get_data()
+    data = np.asanyarray(nii.dataobj)
     if (np.shape(np.shape(data))[0] == 2): #If channel data not present
         data = np.expand_dims(data, 2)
     return data